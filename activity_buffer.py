@@ -0,0 +1,127 @@
+"""
+Write-Behind Activity Timestamps for Mr. Wlah
+
+Bumping a user's lastActive/lastLogin on every action costs a database write
+per request. ActivityBuffer keeps the latest timestamps per user in memory
+and a background thread writes them out periodically as one unordered
+bulk_write, so a busy user costs at most one write per flush interval.
+
+Updates use $max, which makes them safe to repeat, to reorder, and to
+interleave with other worker processes flushing their own buffers.
+"""
+
+import atexit
+import os
+import threading
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+
+class ActivityBuffer:
+    """Coalesces per-user activity timestamps and flushes them in batches"""
+
+    def __init__(self, collection=None, flush_interval=5.0, on_error=None):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+        self.touches = 0
+        self.flushes = 0
+        self.writes = 0
+        self.failures = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+
+    def touch(self, user_id, **timestamps):
+        """Record activity timestamps (e.g. lastActive=now) for user_id; only the latest per field is kept"""
+        if self.collection is None or not user_id:
+            return
+
+        with self._lock:
+            self._merge(user_id, timestamps)
+            self.touches += 1
+        self._ensure_started()
+
+    def _merge(self, user_id, timestamps):
+        fields = self._pending.setdefault(user_id, {})
+        for field, value in timestamps.items():
+            if field not in fields or value > fields[field]:
+                fields[field] = value
+
+    def _ensure_started(self):
+        """Start the flush thread in this process (worker processes fork after import)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='activity-buffer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:  # Keep flushing whatever went wrong this round
+                if self.on_error:
+                    self.on_error(e)
+
+    def flush(self):
+        """Write all pending timestamps with one unordered bulk_write; returns the number of users written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            requests = [UpdateOne({'user_id': user_id}, {'$max': fields}) for user_id, fields in pending.items()]
+            try:
+                self.collection.bulk_write(requests, ordered=False)
+            except PyMongoError as e:
+                # Requeue everything; $max makes rewriting the ones that did land harmless
+                with self._lock:
+                    for user_id, fields in pending.items():
+                        self._merge(user_id, fields)
+                    self.failures += 1
+                if self.on_error:
+                    self.on_error(e)
+                return 0
+
+            self.flushes += 1
+            self.writes += len(requests)
+            return len(requests)
+
+    def stop(self):
+        """Stop the flush thread and write out whatever is still pending"""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval)
+        if self.collection is not None:
+            try:
+                self.flush()
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(e)
+
+    def stats(self):
+        with self._lock:
+            pending_users = len(self._pending)
+        return {
+            'touches': self.touches,
+            'flushes': self.flushes,
+            'writes': self.writes,
+            'failures': self.failures,
+            'pendingUsers': pending_users,
+            'flushIntervalSeconds': self.flush_interval
+        }
@@ -0,0 +1,71 @@
+"""
+API Usage Buckets for Mr. Wlah
+
+Every Gemini call is counted into one document per user per UTC day in the
+apiUsage collection, updated in place with $inc. Usage dashboards and quotas
+read a handful of these small buckets instead of scanning transformations.
+"""
+
+import datetime
+
+# Token counters taken from Gemini's usage_metadata, by bucket field
+USAGE_TOKEN_FIELDS = {
+    'promptTokens': 'prompt_token_count',
+    'outputTokens': 'candidates_token_count',
+    'thoughtsTokens': 'thoughts_token_count',
+    'cachedTokens': 'cached_content_token_count',
+    'totalTokens': 'total_token_count'
+}
+
+
+def usage_day(now):
+    """Start of the UTC day a call falls in; buckets are keyed by it"""
+    return datetime.datetime(now.year, now.month, now.day)
+
+
+def usage_tokens(usage_metadata):
+    """Token counts from a response's usage_metadata (missing counts are 0)"""
+    return {
+        field: getattr(usage_metadata, attribute, None) or 0
+        for field, attribute in USAGE_TOKEN_FIELDS.items()
+    }
+
+
+def usage_bucket_update(success, characters, latency_ms, usage_metadata=None, now=None):
+    """(filter fields, update) that add one call to its daily bucket"""
+    now = now or datetime.datetime.utcnow()
+    increments = {
+        'callCount': 1,
+        'successCount': 1 if success else 0,
+        'errorCount': 0 if success else 1,
+        'characterCount': characters,
+        'latencyMsTotal': round(latency_ms)
+    }
+    increments.update(usage_tokens(usage_metadata))
+    update = {
+        '$inc': increments,
+        '$max': {'latencyMsMax': round(latency_ms), 'lastCallAt': now},
+        '$setOnInsert': {'createdAt': now}
+    }
+    return {'date': usage_day(now)}, update
+
+
+def record_usage(collection, user_id, success, characters, latency_ms, usage_metadata=None, now=None):
+    """
+    Upsert one call into the user's bucket for today. The unique
+    (user_id, date) index makes concurrent first calls of the day converge
+    on a single bucket; the server retries the upsert that loses the race.
+    """
+    key, update = usage_bucket_update(success, characters, latency_ms, usage_metadata, now)
+    collection.update_one(dict(key, user_id=user_id), update, upsert=True)
+
+
+def usage_summary(buckets):
+    """Totals over a list of daily buckets, including average latency"""
+    totals = {'callCount': 0, 'successCount': 0, 'errorCount': 0, 'characterCount': 0, 'latencyMsTotal': 0}
+    totals.update({field: 0 for field in USAGE_TOKEN_FIELDS})
+    for bucket in buckets:
+        for field in totals:
+            totals[field] += bucket.get(field, 0)
+    totals['averageLatencyMs'] = round(totals['latencyMsTotal'] / totals['callCount']) if totals['callCount'] else None
+    return totals
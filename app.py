@@ -1,26 +1,44 @@
 import os
 import sys
-from flask import Flask, request, jsonify, render_template, send_from_directory, send_file, url_for, redirect, session
+from flask import Flask, Request, request, jsonify, render_template, send_from_directory, send_file, url_for, redirect, session
 from flask_cors import CORS
 from dotenv import load_dotenv
 import google.genai as genai
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from pymongo.server_api import ServerApi
 from bson import ObjectId
+from bson.errors import InvalidId
 import json
+import click
+import time
+import base64
 from authlib.integrations.flask_client import OAuth
-import PyPDF2
-import docx
-from docx.shared import Pt
 import datetime
 import re
 import io
 import tempfile
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
+import zlib
 from urllib.parse import urlencode
 import uuid
 import random
+from extraction import extract_pdf_document, select_pdf_pages, extract_docx_file, truncate_docx_text, decode_text_stream, parse_page_range, CHARS_PER_TOKEN, EXTRACTOR_VERSION
+from disk_cache import DiskLRUCache, hash_stream
+from document_store import DocumentStore
+from activity_buffer import ActivityBuffer
+from user_cache import UserCache
+from api_usage import record_usage, usage_day, usage_summary
+from text_storage import DEFAULT_COMPRESS_THRESHOLD, pack_text, unpack_text, text_preview
+from db_indexes import verify_indexes
+from boilerplate import COMPACT_PAGE_MARKER_PATTERN, strip_boilerplate, restore_page_markers
+from rendering import (
+    RENDER_FORMATS, RENDER_EXTENSIONS, EXPORT_FORMATS, RenderQueueFull,
+    render_key, render_in_pool, render_pool_stats, iter_export_zip
+)
+from font_styles import (
+    detect_font_style, apply_font_style, split_styled_runs, format_runs_for_prompt,
+    parse_transformed_runs, rebuild_styled_text, RUN_MARKER_PATTERN
+)
 
 # Import database logging functions
 try:
@@ -37,8 +55,22 @@ except ImportError:
 # Load environment variables
 load_dotenv()
 
+# Uploads above this size are spooled to a named temp file instead of memory;
+# the extraction workers then read that file directly
+UPLOAD_SPOOL_BYTES = int(os.getenv('UPLOAD_SPOOL_KB', 512)) * 1024
+MAX_UPLOAD_MB = int(os.getenv('MAX_UPLOAD_MB', 25))
+
+class UploadRequest(Request):
+    """Request that keeps small uploads in memory and spools large ones to disk"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > UPLOAD_SPOOL_BYTES:
+            suffix = os.path.splitext(filename or '')[1]
+            return tempfile.NamedTemporaryFile('wb+', suffix=suffix)
+        return io.BytesIO()
+
 # Initialize Flask app
 app = Flask(__name__, static_folder='.')
+app.request_class = UploadRequest
 CORS(app, supports_credentials=True)
 
 # Set a more reliable secret key - Generate a fixed key for production
@@ -58,6 +90,24 @@ app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_REFRESH_EACH_REQUEST'] = True
 app.config['SESSION_USE_SIGNER'] = True
 
+# Reject oversized uploads from Content-Length before the body is read
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+
+def upload_too_large_response():
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] / (1024 * 1024)
+    return jsonify({'error': f'File too large, the limit is {limit_mb:g} MB'}), 413
+
+@app.before_request
+def reject_oversized_uploads():
+    """Answer with 413 up front instead of reading a body we would refuse anyway"""
+    if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        return upload_too_large_response()
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    """Bodies without a Content-Length are cut off while streaming"""
+    return upload_too_large_response()
+
 # Configure Google Gemini API
 api_key = os.getenv('GEMINI_API_KEY')
 genai_client = genai.Client(api_key=api_key)
@@ -72,6 +122,8 @@ mongo_db = os.getenv('MONGODB_DATABASE', 'benchai')
 users_collection = None
 transformations_collection = None
 api_usage_collection = None
+documents_collection = None
+migrations_collection = None
 
 # Check if X.509 certificate exists
 cert_path = os.path.join('certs', 'X509-cert-5870665680541743449.pem')
@@ -115,11 +167,18 @@ if has_certificate:
         users_collection = db['users']
         transformations_collection = db['transformations']
         api_usage_collection = db['apiUsage']
+        documents_collection = db['documents']
+        migrations_collection = db['migrations']
         
         # Log connection success with database details
         collections = db.list_collection_names()
         add_system_log(f"Available collections: {', '.join(collections)}", "INFO")
         
+        # Indexes are created at deploy time by db_indexes.py; only check them here
+        missing_indexes = verify_indexes(db)
+        if missing_indexes:
+            add_system_log(f"Missing or outdated indexes (run db_indexes.py): {', '.join(missing_indexes)}", "WARNING")
+        
     except Exception as e:
         error_msg = f"MongoDB connection error: {str(e)}"
         print(f"❌ {error_msg}")
@@ -194,174 +253,130 @@ def clean_llm_response(text):
     
     return text
 
-# Font style detection and preservation
-def detect_font_style(text):
-    """Detect font style markers in HTML or common text formatting"""
-    font_info = {
-        'font_family': None,
-        'font_size': None,
-        'font_style': None,
-        'font_weight': None,
-        'text_decoration': None,
-        'color': None,
-        'html_tags': []
-    }
-    
-    # Check for HTML tags
-    html_tags = re.findall(r'<([a-z0-9]+)[^>]*>', text, re.IGNORECASE)
-    if html_tags:
-        font_info['html_tags'] = list(set(html_tags))
-    
-    # Check for inline CSS
-    font_family_match = re.search(r'font-family:\s*([^;]+);', text, re.IGNORECASE)
-    if font_family_match:
-        font_info['font_family'] = font_family_match.group(1).strip()
-    
-    font_size_match = re.search(r'font-size:\s*([^;]+);', text, re.IGNORECASE)
-    if font_size_match:
-        font_info['font_size'] = font_size_match.group(1).strip()
-    
-    # Check for direct font tags
-    font_tag_match = re.search(r'<font[^>]+face=["\']([^"\']+)["\']', text, re.IGNORECASE)
-    if font_tag_match:
-        font_info['font_family'] = font_tag_match.group(1).strip()
-    
-    # Check for other style indicators
-    if '<b>' in text.lower() or 'font-weight: bold' in text.lower():
-        font_info['font_weight'] = 'bold'
-    
-    if '<i>' in text.lower() or 'font-style: italic' in text.lower():
-        font_info['font_style'] = 'italic'
-    
-    if '<u>' in text.lower() or 'text-decoration: underline' in text.lower():
-        font_info['text_decoration'] = 'underline'
-    
-    # Check for color
-    color_match = re.search(r'color:\s*([^;]+);', text, re.IGNORECASE)
-    if color_match:
-        font_info['color'] = color_match.group(1).strip()
-    
-    return font_info
+# Extraction budget: stop pulling pages once this much text has been collected.
+# Either limit can be set; 0 means unlimited.
+EXTRACTION_MAX_CHARS = int(os.getenv('EXTRACTION_MAX_CHARS', 0))
+EXTRACTION_MAX_TOKENS = int(os.getenv('EXTRACTION_MAX_TOKENS', 0))
 
-def apply_font_style(text, font_info):
-    """Apply detected font style to the output text"""
-    
-    # If no style detected, return text as is
-    if not any(font_info.values()):
-        return text
-    
-    # If HTML tags detected, try to maintain structure
-    if font_info['html_tags'] and not ('script' in font_info['html_tags'] or 'style' in font_info['html_tags']):
-        # Apply basic styling
-        styled_text = text
-        
-        # Apply font family if detected
-        if font_info['font_family']:
-            styled_text = f'<span style="font-family: {font_info["font_family"]}">{styled_text}</span>'
-        
-        # Apply font size if detected
-        if font_info['font_size']:
-            styled_text = f'<span style="font-size: {font_info["font_size"]}">{styled_text}</span>'
-        
-        # Apply bold if detected
-        if font_info['font_weight'] == 'bold':
-            styled_text = f'<b>{styled_text}</b>'
-        
-        # Apply italic if detected
-        if font_info['font_style'] == 'italic':
-            styled_text = f'<i>{styled_text}</i>'
-        
-        # Apply underline if detected
-        if font_info['text_decoration'] == 'underline':
-            styled_text = f'<u>{styled_text}</u>'
-        
-        # Apply color if detected
-        if font_info['color']:
-            styled_text = f'<span style="color: {font_info["color"]}">{styled_text}</span>'
-        
-        return styled_text
-    
-    return text
+def extraction_char_budget(max_chars=None, max_tokens=None):
+    """Combine the server-wide extraction budget with any per-request limits"""
+    limits = [
+        EXTRACTION_MAX_CHARS,
+        EXTRACTION_MAX_TOKENS * CHARS_PER_TOKEN,
+        max_chars or 0,
+        (max_tokens or 0) * CHARS_PER_TOKEN
+    ]
+    limits = [limit for limit in limits if limit > 0]
+    return min(limits) if limits else None
+
+# Extracted text is cached on local disk by content hash, so re-uploads of the
+# same file (by any user) skip PDF/DOCX parsing entirely
+EXTRACTION_CACHE_DIR = os.getenv('EXTRACTION_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'mrwlah-extraction-cache'))
+EXTRACTION_CACHE_MB = int(os.getenv('EXTRACTION_CACHE_MB', 256))
+extraction_cache = DiskLRUCache(EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MB * 1024 * 1024)
+
+def load_cached_extraction(cache_key):
+    """Return the cached extraction record for cache_key, or None"""
+    try:
+        data = extraction_cache.get(cache_key)
+        return json.loads(zlib.decompress(data)) if data else None
+    except Exception as e:
+        add_system_log(f"Ignoring unreadable extraction cache entry {cache_key}: {str(e)}", "WARNING")
+        return None
 
-# Helper function to extract text from different file types
-def extract_text_from_file(file):
+def store_cached_extraction(cache_key, record):
+    """Cache an extraction record; failures only cost a future re-parse"""
+    try:
+        extraction_cache.set(cache_key, zlib.compress(json.dumps(record).encode('utf-8')))
+    except Exception as e:
+        add_system_log(f"Failed to cache extraction {cache_key}: {str(e)}", "WARNING")
+
+# Extracted upload text is stored server-side and referenced by documentId,
+# so the browser only receives a preview instead of the whole document
+DOCUMENT_TTL_MINUTES = int(os.getenv('DOCUMENT_TTL_MINUTES', 60))
+DOCUMENT_PREVIEW_CHARS = int(os.getenv('DOCUMENT_PREVIEW_CHARS', 2000))
+document_store = DocumentStore(documents_collection, DOCUMENT_TTL_MINUTES * 60)
+
+# User records are cached per worker for a short time; writes invalidate them
+USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', 30))
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', 1024))
+user_cache = UserCache(
+    users_collection,
+    USER_CACHE_TTL_SECONDS,
+    USER_CACHE_MAX_ENTRIES,
+    watch_changes=os.getenv('USER_CACHE_CHANGE_STREAM', 'false').lower() == 'true',
+    on_error=lambda e: add_system_log(f"User cache change stream stopped, relying on TTL: {str(e)}", "WARNING")
+)
+
+# lastActive/lastLogin bumps are coalesced per user and written in batches
+ACTIVITY_FLUSH_SECONDS = float(os.getenv('ACTIVITY_FLUSH_SECONDS', 5))
+activity_buffer = ActivityBuffer(
+    users_collection,
+    ACTIVITY_FLUSH_SECONDS,
+    on_error=lambda e: add_system_log(f"Failed to flush user activity: {str(e)}", "WARNING")
+)
+
+# Helper function to extract text from different file types.
+# Returns (text, truncated) where truncated means the budget cut extraction short.
+def extract_text_from_file(file, page_ranges=None, max_chars=None):
     if file.filename.endswith('.txt'):
-        return file.read().decode('utf-8')
+        return decode_text_stream(file.stream, max_chars)
     
-    elif file.filename.endswith('.pdf'):
-        try:
-            # Enhanced PDF text extraction
-            reader = PyPDF2.PdfReader(file)
-            total_pages = len(reader.pages)
-            text = []
-            
-            # Extract text from each page with structure preservation
-            for i in range(total_pages):
-                page = reader.pages[i]
-                page_text = page.extract_text()
-                
-                # Basic structure preservation
-                if page_text:
-                    # Add page number for longer documents
-                    if total_pages > 1:
-                        text.append(f"--- Page {i+1} ---\n")
-                    
-                    # Clean up common PDF extraction issues
-                    lines = page_text.split('\n')
-                    cleaned_lines = []
-                    
-                    for line in lines:
-                        # Remove excessive spaces
-                        cleaned_line = re.sub(r'\s+', ' ', line).strip()
-                        if cleaned_line:
-                            cleaned_lines.append(cleaned_line)
-                    
-                    # Join with proper paragraph breaks
-                    text.append('\n'.join(cleaned_lines))
-                    
-                    # Add extra newline between pages
-                    if i < total_pages - 1:
-                        text.append("\n")
-            
-            return "\n".join(text)
-        except Exception as e:
-            add_system_log(f"PDF extraction error: {str(e)}", "ERROR")
-            # Fallback to basic extraction
-            reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-            
-    elif file.filename.endswith('.docx'):
-        try:
-            # Enhanced DOCX text extraction
-            doc = docx.Document(file)
-            full_text = []
-            
-            # Process paragraphs with structure preservation
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    full_text.append(para.text)
-            
-            # Get text from tables
-            for table in doc.tables:
-                for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            row_text.append(cell.text.strip())
-                    if row_text:
-                        full_text.append(" | ".join(row_text))
-            
-            return "\n\n".join(full_text)
-        except Exception as e:
-            add_system_log(f"DOCX extraction error: {str(e)}", "ERROR")
-            # Fallback to basic extraction
-            doc = docx.Document(file)
-            return "\n".join([paragraph.text for paragraph in doc.paragraphs])
-    else:
+    if not file.filename.endswith(('.pdf', '.docx')):
         raise ValueError("Unsupported file format")
+    
+    # Whole documents are cached, keyed by their content alone; the page
+    # selection and budget are applied to a cached copy per request
+    suffix = os.path.splitext(file.filename)[1]
+    cache_key = hash_stream(file.stream, EXTRACTOR_VERSION, suffix)
+    record = load_cached_extraction(cache_key)
+    if record is not None:
+        if suffix == '.pdf':
+            return select_pdf_pages(record['text'], record['totalPages'], page_ranges, max_chars)
+        return truncate_docx_text(record['text'], max_chars)
+    
+    return extract_document(file, suffix, cache_key, page_ranges, max_chars)
+
+def extract_document(file, suffix, cache_key, page_ranges=None, max_chars=None):
+    """
+    Extract a PDF or DOCX upload that is not cached yet. Only the selected
+    pages (PDF) are parsed, stopping at the budget; the result is cached when it
+    turns out to be the whole document.
+    """
+    # PDF and DOCX parsing runs in sandboxed pool workers, which open the
+    # upload from a path rather than receiving the bytes. Large uploads are
+    # already spooled to a named temp file; small ones are written out here.
+    upload_path = getattr(file.stream, 'name', None)
+    temp_upload = None
+    try:
+        if isinstance(upload_path, str) and os.path.isfile(upload_path):
+            file.stream.flush()
+        else:
+            temp_upload = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+            file.save(temp_upload)
+            temp_upload.close()
+            upload_path = temp_upload.name
+        
+        if suffix == '.pdf':
+            page_errors = []
+            text, truncated, total_pages = extract_pdf_document(upload_path, page_ranges, max_chars, page_errors)
+            for page_number, error in page_errors:
+                add_system_log(f"PDF extraction error on page {page_number} of {file.filename}: {error}", "WARNING")
+            if not page_ranges and not truncated:
+                store_cached_extraction(cache_key, {'text': text, 'totalPages': total_pages})
+            return text, truncated
+        
+        text, truncated = extract_docx_file(upload_path, max_chars)
+        if not truncated:
+            store_cached_extraction(cache_key, {'text': text})
+        return text, truncated
+    except Exception as e:
+        add_system_log(f"{suffix[1:].upper()} extraction error: {str(e)}", "ERROR")
+        raise
+    finally:
+        if temp_upload is not None:
+            temp_upload.close()
+            os.unlink(temp_upload.name)
 
 # Custom JSON encoder to handle MongoDB ObjectId
 class JSONEncoder(json.JSONEncoder):
@@ -515,12 +530,7 @@ def admin_login():
         # If we have a MongoDB connection, flag this user as an admin in the database
         if users_collection is not None and admin_user_id:
             try:
-                # First try to find user by user_id field (primary identifier)
-                user = users_collection.find_one({'user_id': admin_user_id})
-                
-                # If not found, try auth0Id as fallback
-                if not user:
-                    user = users_collection.find_one({'auth0Id': admin_user_id})
+                user = user_cache.get(admin_user_id)
                 
                 if user:
                     # Update the user record to mark as admin
@@ -528,10 +538,10 @@ def admin_login():
                         {'_id': user['_id']},
                         {'$set': {
                             'is_admin': True,
-                            'lastAdminLogin': datetime.datetime.utcnow(),
-                            'user_id': admin_user_id  # Ensure user_id is set correctly
+                            'lastAdminLogin': datetime.datetime.utcnow()
                         }}
                     )
+                    user_cache.invalidate(admin_user_id)
                     add_system_log(f"Updated user record for admin: {admin_email}", "INFO")
                 else:
                     add_system_log(f"Admin user not found in database: {admin_email}", "WARNING")
@@ -555,23 +565,97 @@ def admin_status():
     is_admin = session.get('is_admin', False)
     return jsonify({'isAdmin': is_admin})
 
+@app.route('/api/admin/metrics')
+def admin_metrics():
+    """Render pool, cache, user cache and activity buffer statistics for this worker process"""
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({
+        'pid': os.getpid(),
+        'renderPool': render_pool_stats(),
+        'renderCache': render_cache.stats(),
+        'extractionCache': extraction_cache.stats(),
+        'activityBuffer': activity_buffer.stats(),
+        'userCache': user_cache.stats()
+    })
+
+ADMIN_USERS_PAGE_SIZE = int(os.getenv('ADMIN_USERS_PAGE_SIZE', 50))
+ADMIN_USERS_MAX_PAGE_SIZE = 500
+
+def admin_user_list_fields(admin_user_id):
+    """
+    $project for the admin user list: only the columns the panel shows, with
+    legacy field names and missing values normalized by the server
+    """
+    return {
+        'user_id': {'$ifNull': ['$user_id', {'$ifNull': ['$auth0Id', {'$ifNull': ['$auth0_id', {'$toString': '$_id'}]}]}]},
+        'name': {'$ifNull': ['$name', {'$cond': [
+            {'$eq': [{'$type': '$email'}, 'string']},
+            {'$arrayElemAt': [{'$split': ['$email', '@']}, 0]},
+            'Unknown User'
+        ]}]},
+        'email': {'$ifNull': ['$email', 'No email']},
+        'username': 1,
+        'createdAt': {'$ifNull': ['$createdAt', '$created_at']},
+        'lastLogin': {'$ifNull': ['$lastLogin', '$last_login']},
+        'lastActive': {'$ifNull': ['$lastActive', {'$ifNull': ['$lastLogin', {'$ifNull': ['$last_login', {'$ifNull': ['$createdAt', '$created_at']}]}]}]},
+        'is_admin': {'$ifNull': ['$is_admin', False]},
+        'isCurrentAdmin': {'$eq': ['$user_id', {'$literal': admin_user_id}]},
+        # The stored sort key, for the next page's cursor
+        'sortActive': '$lastActive'
+    }
+
+def encode_admin_users_cursor(user):
+    """Opaque cursor pointing just past a user in the admin list"""
+    active = user.get('sortActive')
+    position = f"{active.isoformat() if isinstance(active, datetime.datetime) else ''}|{user['_id']}"
+    return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+def decode_admin_users_cursor(cursor):
+    """(lastActive or None, _id) from a cursor; raises ValueError if it is malformed"""
+    try:
+        active, user_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+        return (datetime.datetime.fromisoformat(active) if active else None), ObjectId(user_id)
+    except InvalidId as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def admin_users_after(active, user_id):
+    """
+    Users sorting after (active, user_id) in (lastActive, _id) descending
+    order. Users without lastActive sort last; a date comparison never
+    matches them, so they get their own branch. MongoDB only compares
+    values of the same type, so this relies on every lastActive being a
+    date or null (the lastActiveDates step of migrate-users).
+    """
+    if active is None:
+        return {'lastActive': None, '_id': {'$lt': user_id}}
+    return {'$or': [
+        {'lastActive': {'$lt': active}},
+        {'lastActive': active, '_id': {'$lt': user_id}},
+        {'lastActive': None}
+    ]}
+
 @app.route('/api/admin/users')
 def admin_get_users():
-    """Get all users for admin panel, with optional filters for recent activity and by Auth0 ID/user_id"""
+    """
+    One page of users for the admin panel, most recently active first, with
+    optional filters for recent activity and by Auth0 ID/user_id; pass
+    nextCursor back as cursor for the next page
+    """
     # Check if admin
     if not session.get('is_admin', False):
         return jsonify({'error': 'Unauthorized'}), 401
     
     try:
         if users_collection is not None:
-            add_system_log("Fetching users from database for admin panel", "INFO")
             admin_profile = session.get('profile', {})
             admin_user_id = admin_profile.get('user_id', '')
 
-            # --- NEW: Support query params ---
             recent = request.args.get('recent', 'false').lower() == 'true'
             auth0_id = request.args.get('auth0_id')
             user_id_param = request.args.get('user_id')
+            limit = min(max(request.args.get('limit', ADMIN_USERS_PAGE_SIZE, type=int), 1), ADMIN_USERS_MAX_PAGE_SIZE)
             query = {}
             now = datetime.datetime.utcnow()
             
@@ -579,57 +663,37 @@ def admin_get_users():
                 # Only users active in the last 24 hours
                 since = now - datetime.timedelta(hours=24)
                 query['lastActive'] = {'$gte': since}
-            if auth0_id:
-                query['$or'] = [
-                    {'auth0Id': auth0_id},
-                    {'user_id': auth0_id}
-                ]
-            if user_id_param:
-                query['$or'] = [
-                    {'user_id': user_id_param},
-                    {'auth0Id': user_id_param}
-                ]
+            # Every user record carries user_id since the normalize-user-id
+            # migration (migrate_schema.py), so both ID filters use that field
+            if user_id_param or auth0_id:
+                query['user_id'] = user_id_param or auth0_id
             
-            # If both recent and id filter, combine
-            # (MongoDB $and for both filters)
-            if (recent and (auth0_id or user_id_param)):
-                or_filter = query.pop('$or')
-                query = {'$and': [query, {'$or': or_filter}]}
+            cursor = request.args.get('cursor')
+            if cursor:
+                try:
+                    after = admin_users_after(*decode_admin_users_cursor(cursor))
+                except ValueError:
+                    return jsonify({'error': 'Invalid cursor'}), 400
+                query = {'$and': [query, after]} if query else after
             
-            users = list(users_collection.find(query).sort([
-                ('lastLogin', -1), 
-                ('lastActive', -1),
-                ('createdAt', -1)
+            # The (lastActive, _id) index serves the match, sort and limit, so
+            # every page costs the same however deep it is; one extra user
+            # tells whether another page follows
+            users = list(users_collection.aggregate([
+                {'$match': query},
+                {'$sort': {'lastActive': -1, '_id': -1}},
+                {'$limit': limit + 1},
+                {'$project': admin_user_list_fields(admin_user_id)}
             ]))
-            add_system_log(f"Found {len(users)} users in database (query: {query})", "INFO")
+            
+            next_cursor = encode_admin_users_cursor(users[limit - 1]) if len(users) > limit else None
+            users = users[:limit]
             for user in users:
-                if users.index(user) == 0:
-                    add_system_log(f"Sample user data: {user}", "INFO")
                 user['_id'] = str(user['_id'])
-                if 'user_id' not in user:
-                    if 'auth0Id' in user:
-                        user['user_id'] = user['auth0Id']
-                    elif 'auth0_id' in user:
-                        user['user_id'] = user['auth0_id']
-                    else:
-                        user['user_id'] = user['_id']
-                if 'lastLogin' in user and 'lastActive' not in user:
-                    user['lastActive'] = user['lastLogin']
-                elif 'last_login' in user and 'lastActive' not in user:
-                    user['lastActive'] = user['last_login']
-                elif 'lastActive' not in user:
-                    user['lastActive'] = user.get('createdAt', None) or user.get('created_at', None)
-                # Subscription and usage count fields removed
-                if 'name' not in user and 'email' in user:
-                    user['name'] = user['email'].split('@')[0]
-                elif 'name' not in user:
-                    user['name'] = 'Unknown User'
-                if 'email' not in user:
-                    user['email'] = 'No email'
-                if admin_user_id and user.get('user_id') == admin_user_id:
-                    user['isCurrentAdmin'] = True
+                user.pop('sortActive', None)
+            
             add_system_log(f"Admin fetched user list ({len(users)} users)", "INFO")
-            if not users:
+            if not users and not cursor:
                 add_system_log("No users found in database, returning sample data", "WARNING")
                 if admin_profile and admin_profile.get('user_id'):
                     users.append({
@@ -648,7 +712,7 @@ def admin_get_users():
                         'lastActive': datetime.datetime.now().isoformat(),
                         'user_id': 'sample-user-id'
                     })
-            return jsonify(users)
+            return jsonify({'users': users, 'nextCursor': next_cursor})
         else:
             add_system_log("No database connection, returning sample data", "WARNING")
             admin_profile = session.get('profile', {})
@@ -669,7 +733,7 @@ def admin_get_users():
                 'lastActive': datetime.datetime.now().isoformat(),
                 'user_id': 'sample-user-id'
             })
-            return jsonify(sample_data)
+            return jsonify({'users': sample_data, 'nextCursor': None})
     except Exception as e:
         add_system_log(f"Error fetching users: {str(e)}", "ERROR")
         return jsonify({'error': str(e)}), 500
@@ -710,6 +774,7 @@ def admin_add_user():
                     {'_id': existing_user['_id']},
                     {'$set': update_data}
                 )
+                user_cache.invalidate(data['user_id'])
                 
                 # Log the update
                 if update_result.modified_count > 0:
@@ -746,6 +811,7 @@ def admin_add_user():
                 }
                 
                 insert_result = users_collection.insert_one(new_user)
+                user_cache.invalidate(data['user_id'])
                 
                 add_system_log(f"Admin manually added user: {data['user_id']} ({data['name']})", "INFO")
                 
@@ -786,46 +852,23 @@ def record_transformation():
         timestamp = data.get('timestamp', datetime.datetime.utcnow().isoformat())
         
         if users_collection is not None:
-            # Prioritize looking for user by user_id
-            user = users_collection.find_one({'user_id': user_id})
-            
-            # Fallback to auth0Id if not found
-            if not user:
-                user = users_collection.find_one({'auth0Id': user_id})
-            
-            if user:
-                # Update existing user (removed usage count increment)
-                users_collection.update_one(
-                    {'_id': user['_id']},
-                    {
-                        '$set': {
-                            'lastActive': timestamp,
-                            # Ensure user_id is always set
-                            'user_id': user_id
-                        }
-                    }
+            now = datetime.datetime.utcnow()
+            # Cached users cost no round trip. Otherwise one upsert creates the
+            # record if this is the user's first action; it only sets fields on
+            # insert, so for an existing user the returned record is current
+            # and goes into the cache
+            if user_cache.peek(user_id) is None:
+                existing = upsert_user(
+                    user_id,
+                    new_user_fields(user_id, profile.get('email', ''), profile.get('name', ''), now)
                 )
-            else:
-                # If user not found, create a new record
-                add_system_log(f"User {user_id} not found in database for recording transformation, creating new record", "INFO")
-                
-                # Create new user (removed subscription fields)
-                timestamp_now = datetime.datetime.now()
-                new_user = {
-                    'user_id': user_id,
-                    'auth0Id': user_id,  # Store both for backward compatibility
-                    'email': profile.get('email', ''),
-                    'name': profile.get('name', ''),
-                    'createdAt': timestamp_now,
-                    'lastLogin': timestamp_now,
-                    'lastActive': timestamp_now,
-                    'preferences': {
-                        'defaultTone': 'casual',
-                        'saveHistory': True
-                    }
-                }
-                
-                users_collection.insert_one(new_user)
+                if existing is None:
+                    add_system_log(f"User {user_id} not found in database for recording transformation, created new record", "INFO")
+                else:
+                    user_cache.put(existing)
+            
+            # lastActive is written with the next activity flush
+            activity_buffer.touch(user_id, lastActive=now)
             
             # Record transformation in history if enabled
             if transformations_collection is not None:
@@ -844,6 +887,65 @@ def record_transformation():
         add_system_log(f"Error recording transformation: {str(e)}", "ERROR")
         return jsonify({'error': str(e)}), 500
 
+def generate_username(email, name):
+    """Username from the email or name, with a random suffix to keep it unique"""
+    if email:
+        username_base = email.split('@')[0].replace('.', '').lower()
+    elif name:
+        username_base = name.replace(' ', '').lower()
+    else:
+        username_base = f"user_{uuid.uuid4().hex[:8]}"
+    return f"{username_base}_{random.randint(1000, 9999)}"
+
+def new_user_fields(user_id, email, name, now):
+    """Fields a user record is created with, for $setOnInsert (user_id itself comes from the filter)"""
+    return {
+        'auth0Id': user_id,  # Store both for backward compatibility
+        'email': email,
+        'name': name,
+        'username': generate_username(email, name),
+        'createdAt': now,
+        'lastLogin': now,
+        'lastActive': now,
+        'preferences': {
+            'defaultTone': 'casual',
+            'saveHistory': True
+        }
+    }
+
+def upsert_user(user_id, insert_fields, update=None, projection=None):
+    """
+    Create the user record if it is missing and apply update, in one round
+    trip. Fields in update take precedence over the matching insert fields.
+    Returns the record as it was before (None if it was just created).
+    """
+    update = {operator: fields for operator, fields in (update or {}).items() if fields}
+    updated_fields = {field for fields in update.values() for field in fields}
+    update['$setOnInsert'] = {field: value for field, value in insert_fields.items() if field not in updated_fields}
+    
+    try:
+        return users_collection.find_one_and_update(
+            {'user_id': user_id}, update,
+            projection=projection, upsert=True, return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # A concurrent login created the record first; this time the update applies to it
+        return users_collection.find_one_and_update(
+            {'user_id': user_id}, update,
+            projection=projection, upsert=True, return_document=ReturnDocument.BEFORE
+        )
+    finally:
+        user_cache.invalidate(user_id)
+
+def record_api_usage(user_id, success, characters, latency_ms, usage_metadata=None):
+    """Count a Gemini call into apiUsage; failures are logged, never raised"""
+    if api_usage_collection is None or not user_id:
+        return
+    try:
+        record_usage(api_usage_collection, user_id, success, characters, latency_ms, usage_metadata)
+    except Exception as e:
+        add_system_log(f"Failed to record API usage for {user_id}: {str(e)}", "WARNING")
+
 @app.route('/api/transform', methods=['POST'])
 def transform_text():
     """Transform text using Gemini"""
@@ -857,23 +959,37 @@ def transform_text():
     
     # Rate limiting removed - allow unlimited transformations
     
+    document_id = None
+    
     try:
         # Check if this is a file upload from FormData
         if request.files and 'file' in request.files:
             file = request.files['file']
             try:
+                # Optional page selection (e.g. "1-3,7") and extraction budget
+                pages = request.form.get('pages')
+                page_ranges = parse_page_range(pages) if pages else None
+                max_chars = extraction_char_budget(
+                    request.form.get('maxChars', type=int),
+                    request.form.get('maxTokens', type=int)
+                )
+                
                 # Extract text from the file
-                text = extract_text_from_file(file)
+                text, truncated = extract_text_from_file(file, page_ranges=page_ranges, max_chars=max_chars)
+                if truncated:
+                    add_system_log(f"Extraction of {file.filename} stopped at the {max_chars} character budget", "INFO")
                 
                 # If we're just extracting text for display, return it
                 if request.form.get('extract_only') == 'true':
-                    return jsonify({'originalText': text})
+                    return jsonify({'originalText': text, 'truncated': truncated})
                 
                 # Otherwise, set it for transformation below
                 tone = request.form.get('tone', 'casual')
                 preserve_font = request.form.get('preserveFont', 'true') == 'true'
                 target_word_count = request.form.get('targetWordCount')
                 mode = request.form.get('mode')
+                strip_page_furniture = request.form.get('stripBoilerplate', 'true') == 'true'
+                keep_pages = request.form.get('keepPages') == 'true'
                 if target_word_count:
                     target_word_count = int(target_word_count)
             except Exception as e:
@@ -881,11 +997,25 @@ def transform_text():
         else:
             # Get request data from JSON
             data = request.get_json() if request.is_json else {}
-            text = data.get('text', '')
+            document_id = data.get('documentId')
+            if document_id:
+                # Text from an earlier upload, stored server-side
+                document = document_store.get(document_id, user_id)
+                if not document:
+                    return jsonify({
+                        'error': 'Document expired, please upload it again',
+                        'documentExpired': True
+                    }), 404
+                text = document['text']
+            else:
+                text = data.get('text', '')
             tone = data.get('tone', 'casual')
             preserve_font = data.get('preserveFont', True)
             target_word_count = data.get('targetWordCount')
             mode = data.get('mode')
+            # Accept JSON booleans and the form branch's "true"/"false" strings alike
+            strip_page_furniture = str(data.get('stripBoilerplate', True)).lower() == 'true'
+            keep_pages = str(data.get('keepPages', False)).lower() == 'true'
             
             if not text:
                 return jsonify({'error': 'No text or file provided'}), 400
@@ -903,17 +1033,66 @@ def transform_text():
         
         # If this is just a file upload without immediate transformation
         if request.files and not request.form.get('transform', False):
-            # Return the extracted text without transformation
-            return jsonify({
-                'originalText': text,
+            # Keep the extracted text server-side and return a handle plus a preview
+            document_id = document_store.put(user_id, text, file.filename, truncated)
+            upload_response = {
+                'documentId': document_id,
+                'preview': text[:DOCUMENT_PREVIEW_CHARS],
+                'complete': len(text) <= DOCUMENT_PREVIEW_CHARS,
+                'characterCount': len(text),
+                'wordCount': len(text.split()),
+                'truncated': truncated,
                 'message': 'File processed successfully'
-            })
+            }
+            if document_id is None:
+                add_system_log(f"Could not store {file.filename}, returning its text inline", "WARNING")
+                upload_response['originalText'] = text
+            return jsonify(upload_response)
+        
+        # Page markers, running headers/footers and page numbers are stripped
+        # before prompting; page breaks survive only as compact markers if asked
+        keep_pages = keep_pages and mode is None
+        source_text = text
+        boilerplate_stats = None
+        if strip_page_furniture:
+            source_text, boilerplate_stats = strip_boilerplate(text, keep_pages=keep_pages)
+            if boilerplate_stats['tokensSaved']:
+                add_system_log(
+                    f"Stripped {boilerplate_stats['linesRemoved']} boilerplate lines, "
+                    f"saving ~{boilerplate_stats['tokensSaved']} tokens", "INFO"
+                )
         
         # Detect font style if preservation is requested
-        font_info = detect_font_style(text) if preserve_font else {}
-        
-        # Calculate original word count if target requested
-        original_word_count = len(text.split()) if target_word_count else None
+        font_info = detect_font_style(source_text) if preserve_font else {}
+        
+        # For styled HTML, only the text runs go to Gemini; the markup is kept
+        # aside as a skeleton and the transformed runs are reinserted into it
+        prompt_text = source_text
+        markup_instruction = ""
+        if keep_pages and '⟦PAGE ' in source_text:
+            markup_instruction = (
+                "IMPORTANT: Page breaks are marked like ⟦PAGE 3⟧ on their own line. "
+                "Keep every page marker exactly as written, in the same order."
+            )
+        markup_skeleton = None
+        markup_runs = []
+        if preserve_font and mode is None and font_info.get('html_tags'):
+            markup_skeleton, markup_runs = split_styled_runs(source_text)
+            if markup_runs:
+                prompt_text = format_runs_for_prompt(markup_runs)
+                # Appended, so a page-marker instruction above still applies
+                markup_instruction = "\n\n".join(filter(None, [markup_instruction, (
+                    "IMPORTANT: The text is split into numbered runs, each starting with a marker like ⟦0⟧. "
+                    "Rewrite each run in place and keep every marker exactly once, in the same order. "
+                    "Do not add, merge or remove markers."
+                )]))
+        
+        # Calculate original word count if target requested; run and page
+        # markers are not words
+        original_word_count = None
+        if target_word_count:
+            counted_text = ' '.join(markup_runs) if markup_runs else source_text
+            original_word_count = len(COMPACT_PAGE_MARKER_PATTERN.sub(' ', counted_text).split())
         
         # List of adjectives to avoid for AI detection
         forbidden_adjectives = [
@@ -969,7 +1148,7 @@ Summarize the core idea of the following text using primarily emojis and ASCII s
 - You may use minimal punctuation or separators if needed.
 
 Text:
-{text}
+{source_text}
 """
                 # For emoji summary, font preservation is irrelevant
                 preserve_font = False
@@ -983,7 +1162,7 @@ Rewrite each declarative sentence from the text as its logical negation.
 - Output only the rewritten text with the same sentence order.
 
 Text:
-{text}
+{source_text}
 """
                 preserve_font = False
             elif mode == "fa_translate":
@@ -994,7 +1173,7 @@ Translate the following text into Persian (Farsi) in a formal register.
 - No transliteration of names.
 
 Text:
-{text}
+{source_text}
 """
                 preserve_font = False
         else:
@@ -1014,7 +1193,9 @@ Text:
                      IMPORTANT: Do NOT start the text with conversational openings like \"Okay\", \"So\", \"Well\", 
                      \"Alright\", or similar words. Begin with substantive content directly.
                      
-                     Text to transform: {text}"""
+                     {markup_instruction}
+                     
+                     Text to transform: {prompt_text}"""
             else:
                 prompt = f"""{tone_instruction}
                      
@@ -1026,13 +1207,23 @@ Text:
                      IMPORTANT: Do NOT start the text with conversational openings like \"Okay\", \"So\", \"Well\", 
                      \"Alright\", or similar words. Begin with substantive content directly.
                      
-                     Text to transform: {text}"""
+                     {markup_instruction}
+                     
+                     Text to transform: {prompt_text}"""
         
-        # Call Gemini API with new client pattern
-        response = genai_client.models.generate_content(
-            model=model_name,
-            contents=prompt
-        )
+        # Call Gemini API with new client pattern, counting the call into the
+        # user's daily usage bucket whether or not it succeeds
+        gemini_started = time.perf_counter()
+        try:
+            response = genai_client.models.generate_content(
+                model=model_name,
+                contents=prompt
+            )
+        except Exception:
+            record_api_usage(user_id, False, len(prompt_text), (time.perf_counter() - gemini_started) * 1000)
+            raise
+        record_api_usage(user_id, True, len(prompt_text), (time.perf_counter() - gemini_started) * 1000,
+                         getattr(response, 'usage_metadata', None))
         
         transformed_text = response.text
         
@@ -1045,19 +1236,35 @@ Text:
             if len(transformed_text) > 500:
                 transformed_text = transformed_text[:500]
         
+        if keep_pages:
+            transformed_text = restore_page_markers(transformed_text)
+        
         # Apply original font style if preservation is requested
         if preserve_font and (mode is None):
-            transformed_text = apply_font_style(transformed_text, font_info)
+            transformed_runs = None
+            if markup_runs:
+                transformed_runs = parse_transformed_runs(transformed_text, len(markup_runs))
+            
+            if transformed_runs is not None:
+                # Rebuild the original markup around the rewritten runs
+                transformed_text = rebuild_styled_text(markup_skeleton, transformed_runs)
+            else:
+                if markup_runs:
+                    add_system_log("Run markers missing from Gemini output, falling back to whole-text styling", "WARNING")
+                    transformed_text = RUN_MARKER_PATTERN.sub('', transformed_text).strip()
+                transformed_text = apply_font_style(transformed_text, font_info)
         
         # Log the transformation if MongoDB is configured and user is authenticated
         if transformations_collection is not None and user_id:
             try:
-                # Create the transformation record
+                # Create the transformation record; large bodies are stored compressed
+                preview, preview_truncated = text_preview(transformed_text, HISTORY_PREVIEW_CHARS)
                 transformation = {
-                    'userId': user_id,  # Use user_id as the primary identifier
-                    'user_id': user_id,  # Also store as user_id for consistency with other collections
-                    'originalText': text,
-                    'transformedText': transformed_text,
+                    'user_id': user_id,
+                    'originalText': pack_text(text, TEXT_COMPRESS_BYTES),
+                    'transformedText': pack_text(transformed_text, TEXT_COMPRESS_BYTES),
+                    'preview': preview,
+                    'previewTruncated': preview_truncated,
                     'tone': tone,
                     'fontStylePreserved': preserve_font,
                     'createdAt': datetime.datetime.now(),
@@ -1065,7 +1272,8 @@ Text:
                         'characterCount': len(text),
                         'wordCount': original_word_count,
                         'targetWordCount': target_word_count,
-                        'sourceType': 'file' if request.files else 'paste',
+                        'sourceType': 'file' if request.files or document_id else 'paste',
+                        'tokensSaved': boilerplate_stats['tokensSaved'] if boilerplate_stats else 0,
                         'modelUsed': model_name
                     }
                 }
@@ -1083,7 +1291,7 @@ Text:
         return jsonify({
             'transformedText': transformed_text, 
             'fontInfo': font_info,
-            'originalText': text
+            'boilerplate': boilerplate_stats
         })
     
     except Exception as e:
@@ -1092,31 +1300,235 @@ Text:
         add_system_log(error_msg, "ERROR")
         return jsonify({'error': 'Failed to transform text'}), 500
 
+@app.route('/api/documents/<document_id>', methods=['GET'])
+def get_uploaded_document(document_id):
+    """Full text of an uploaded document, fetched only when the user wants to edit it"""
+    profile = session.get('profile')
+    if not profile:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    document = document_store.get(document_id, profile.get('user_id'))
+    if not document:
+        return jsonify({'error': 'Document expired, please upload it again', 'documentExpired': True}), 404
+    
+    return jsonify({
+        'documentId': document['_id'],
+        'filename': document['filename'],
+        'text': document['text'],
+        'truncated': document['truncated']
+    })
+
+# History is paged newest first by (createdAt, _id); pages hold summaries and
+# a preview, and the full text is fetched per item
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 20))
+HISTORY_MAX_PAGE_SIZE = 100
+HISTORY_PREVIEW_CHARS = int(os.getenv('HISTORY_PREVIEW_CHARS', 200))
+
+# Stored text bodies at least this many bytes long are zlib-compressed
+TEXT_COMPRESS_BYTES = int(os.getenv('TEXT_COMPRESS_BYTES', DEFAULT_COMPRESS_THRESHOLD))
+
+HISTORY_SUMMARY_PROJECTION = {
+    'createdAt': 1,
+    'tone': 1,
+    'fontStylePreserved': 1,
+    'metadata.characterCount': 1,
+    'metadata.wordCount': 1,
+    'metadata.sourceType': 1,
+    # Stored at write time; records from before then get it computed by the
+    # server from their (always uncompressed) body
+    'preview': {'$ifNull': ['$preview', {'$cond': [
+        {'$eq': [{'$type': '$transformedText'}, 'string']},
+        {'$substrCP': ['$transformedText', 0, HISTORY_PREVIEW_CHARS]},
+        ''
+    ]}]},
+    'previewTruncated': {'$ifNull': ['$previewTruncated', {'$cond': [
+        {'$eq': [{'$type': '$transformedText'}, 'string']},
+        {'$gt': [{'$strLenCP': '$transformedText'}, HISTORY_PREVIEW_CHARS]},
+        False
+    ]}]}
+}
+
+def encode_history_cursor(record):
+    """Opaque cursor pointing just past a history record"""
+    position = f"{record['createdAt'].isoformat()}|{record['_id']}"
+    return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+def decode_history_cursor(cursor):
+    """(createdAt, _id) from a cursor; raises ValueError if it is malformed"""
+    try:
+        created, record_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+        return datetime.datetime.fromisoformat(created), ObjectId(record_id)
+    except InvalidId as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def serialize_history_record(record):
+    """History record as JSON-safe fields"""
+    record['_id'] = str(record['_id'])
+    record['createdAt'] = record['createdAt'].isoformat()
+    return record
+
 @app.route('/api/user/transformations', methods=['GET'])
 def get_user_transformations():
+    """One page of the current user's history, newest first; pass nextCursor back as cursor for the next page"""
+    profile = session.get('profile')
+    if not profile:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
     if transformations_collection is None:
         return jsonify({'error': 'MongoDB not configured', 'demo': True}), 200
     
-    user_id = request.args.get('userId')
-    if not user_id:
-        return jsonify({'error': 'User ID required'}), 400
+    user_id = profile.get('user_id')
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), HISTORY_MAX_PAGE_SIZE)
+    
+    # Only records with a real creation date are listed; this also bounds the
+    # createdAt range so the (user_id, createdAt, _id) index answers the query
+    query = {'user_id': user_id, 'createdAt': {'$type': 'date'}}
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            created, record_id = decode_history_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        # user_id is repeated in each branch so both get full index bounds
+        query = {'$or': [
+            {'user_id': user_id, 'createdAt': {'$lt': created}},
+            {'user_id': user_id, 'createdAt': created, '_id': {'$lt': record_id}}
+        ]}
     
     try:
-        # Find transformations for this user by searching for both userId and user_id fields
-        transformations = list(transformations_collection.find(
-            {'$or': [
-                {'userId': user_id},  # Backward compatibility with older records
-                {'user_id': user_id}   # New user_id field
-            ]}
-        ).sort('createdAt', -1).limit(10))
+        # One extra record tells whether another page follows
+        records = list(transformations_collection.find(query, HISTORY_SUMMARY_PROJECTION)
+                       .sort([('createdAt', -1), ('_id', -1)])
+                       .limit(limit + 1))
+        
+        next_cursor = encode_history_cursor(records[limit - 1]) if len(records) > limit else None
+        transformations = [serialize_history_record(record) for record in records[:limit]]
         
         add_system_log(f"Retrieved {len(transformations)} transformations for user {user_id}", "INFO")
-        return jsonify({'transformations': transformations})
+        return jsonify({'transformations': transformations, 'nextCursor': next_cursor})
     except Exception as e:
         error_msg = f"Error retrieving transformations: {str(e)}"
         add_system_log(error_msg, "ERROR")
         return jsonify({'error': error_msg}), 500
 
+@app.route('/api/user/transformations/<transformation_id>', methods=['GET'])
+def get_user_transformation(transformation_id):
+    """Full text of one history record"""
+    profile = session.get('profile')
+    if not profile:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    if transformations_collection is None:
+        return jsonify({'error': 'MongoDB not configured', 'demo': True}), 200
+    
+    try:
+        record_id = ObjectId(transformation_id)
+    except (InvalidId, TypeError):
+        return jsonify({'error': 'Invalid transformation ID'}), 400
+    
+    try:
+        record = transformations_collection.find_one(
+            {'_id': record_id, 'user_id': profile.get('user_id')},
+            {'createdAt': 1, 'tone': 1, 'fontStylePreserved': 1, 'metadata': 1, 'originalText': 1, 'transformedText': 1}
+        )
+    except Exception as e:
+        error_msg = f"Error retrieving transformation: {str(e)}"
+        add_system_log(error_msg, "ERROR")
+        return jsonify({'error': error_msg}), 500
+    
+    if not record:
+        return jsonify({'error': 'Transformation not found'}), 404
+    
+    record['_id'] = str(record['_id'])
+    record['originalText'] = unpack_text(record.get('originalText'))
+    record['transformedText'] = unpack_text(record.get('transformedText'))
+    if isinstance(record.get('createdAt'), datetime.datetime):
+        record['createdAt'] = record['createdAt'].isoformat()
+    return jsonify(record)
+
+# Longest window /api/user/usage reports on
+USAGE_MAX_DAYS = 366
+
+@app.route('/api/user/usage', methods=['GET'])
+def get_user_usage():
+    """The current user's daily Gemini usage buckets for the last ?days= days (default 30), with totals"""
+    profile = session.get('profile')
+    if not profile:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    if api_usage_collection is None:
+        return jsonify({'error': 'MongoDB not configured', 'demo': True}), 200
+    
+    days = min(max(request.args.get('days', 30, type=int), 1), USAGE_MAX_DAYS)
+    since = usage_day(datetime.datetime.utcnow()) - datetime.timedelta(days=days - 1)
+    
+    try:
+        buckets = list(api_usage_collection.find(
+            {'user_id': profile.get('user_id'), 'date': {'$gte': since}},
+            {'_id': 0, 'user_id': 0, 'createdAt': 0}
+        ).sort('date', -1))
+    except Exception as e:
+        error_msg = f"Error retrieving API usage: {str(e)}"
+        add_system_log(error_msg, "ERROR")
+        return jsonify({'error': error_msg}), 500
+    
+    totals = usage_summary(buckets)
+    for bucket in buckets:
+        bucket['date'] = bucket['date'].strftime('%Y-%m-%d')
+        if isinstance(bucket.get('lastCallAt'), datetime.datetime):
+            bucket['lastCallAt'] = bucket['lastCallAt'].isoformat()
+    return jsonify({'days': days, 'usage': buckets, 'totals': totals})
+
+# Largest number of history items in one bulk export
+BULK_EXPORT_MAX_ITEMS = int(os.getenv('BULK_EXPORT_MAX_ITEMS', 500))
+
+@app.route('/api/user/transformations/export', methods=['POST'])
+def export_user_transformations():
+    """Stream selected history items as a zip of PDF, DOCX, ODT or TXT files"""
+    profile = session.get('profile')
+    if not profile:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    if transformations_collection is None:
+        return jsonify({'error': 'MongoDB not configured', 'demo': True}), 200
+    
+    data = request.get_json(silent=True) or {}
+    format_type = data.get('fileType', 'pdf')
+    ids = data.get('ids')
+    
+    if format_type not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported file type: {format_type}'}), 400
+    if not isinstance(ids, list) or not ids:
+        return jsonify({'error': 'Select at least one transformation to export'}), 400
+    if len(ids) > BULK_EXPORT_MAX_ITEMS:
+        return jsonify({'error': f'At most {BULK_EXPORT_MAX_ITEMS} transformations can be exported at once'}), 400
+    
+    try:
+        object_ids = [ObjectId(item_id) for item_id in ids]
+    except (InvalidId, TypeError):
+        return jsonify({'error': 'Invalid transformation ID'}), 400
+    
+    user_id = profile.get('user_id')
+    cursor = transformations_collection.find(
+        {'_id': {'$in': object_ids}, 'user_id': user_id},
+        {'transformedText': 1, 'tone': 1, 'createdAt': 1}
+    ).sort('createdAt', -1)
+    
+    def export_items():
+        # Records are read from the cursor as the archive is written
+        for index, record in enumerate(cursor, 1):
+            created = record.get('createdAt')
+            if not isinstance(created, datetime.datetime):
+                created = datetime.datetime.now()
+            tone = re.sub(r'[^a-z0-9_-]', '', str(record.get('tone') or '').lower()) or 'text'
+            yield f"{index:03d}-{created:%Y-%m-%d-%H%M%S}-{tone}", created.timetuple()[:6], unpack_text(record.get('transformedText')) or ''
+    
+    log_user_activity(user_id, "EXPORT_TRANSFORMATIONS", {"count": len(object_ids), "format": format_type})
+    
+    response = app.response_class(iter_export_zip(export_items(), format_type), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="mr-wlah-history.zip"'
+    return response
+
 # Auth0 routes
 @app.route('/api/auth/login')
 def login():
@@ -1179,99 +1591,41 @@ def callback():
             try:
                 # Get the user ID from Auth0
                 auth0_id = userinfo['sub']
+                login_time = datetime.datetime.utcnow()
                 
-                # First try to find user by user_id field (primary identifier)
-                user = users_collection.find_one({'user_id': auth0_id})
-                
-                # If not found, try auth0Id as fallback
-                if not user:
-                    user = users_collection.find_one({'auth0Id': auth0_id})
-                
-                timestamp_now = datetime.datetime.now()
+                # Create the user on first login, otherwise refresh the profile
+                # and login time, in a single atomic round trip
+                try:
+                    user = upsert_user(
+                        auth0_id,
+                        new_user_fields(auth0_id, userinfo.get('email', ''), userinfo.get('name', ''), login_time),
+                        {
+                            '$set': {field: userinfo[field] for field in ('name', 'email') if userinfo.get(field)},
+                            '$max': {'lastLogin': login_time, 'lastActive': login_time}
+                        },
+                        projection={'username': 1, 'preferences': 1}
+                    )
+                except Exception as upsert_exc:
+                    add_system_log(f"CRITICAL: Failed to create or update user: {str(upsert_exc)}", "ERROR")
+                    return redirect('/login?error=user_creation_failed')
                 
-                # If not, create user record - use field names matching existing data in the db
-                if not user:
-                    # Generate a username based on email or name to avoid null username issues
-                    email = userinfo.get('email', '')
-                    name = userinfo.get('name', '')
-                    
-                    if email:
-                        # Try to use email as the basis for username
-                        username_base = email.split('@')[0].replace('.', '').lower()
-                    elif name:
-                        # If no email, use name
-                        username_base = name.replace(' ', '').lower()
-                    else:
-                        # Last resort, generate a random username
-                        username_base = f"user_{uuid.uuid4().hex[:8]}"
-                    
-                    # Add a random number to ensure uniqueness
-                    username = f"{username_base}_{random.randint(1000, 9999)}"
-                    
-                    new_user = {
-                        'user_id': auth0_id,             # Primary identifier
-                        'auth0Id': auth0_id,             # For backward compatibility
-                        'email': userinfo.get('email', ''),
-                        'name': userinfo.get('name', ''),
-                        'username': username,            # Always set a username
-                        'createdAt': timestamp_now,      # Match existing field format in db
-                        'lastLogin': timestamp_now,      # Match existing field format in db
-                        'lastActive': timestamp_now,     # For admin panel compatibility
-                        'preferences': {                 # Add user preferences
-                            'defaultTone': 'casual',
-                            'saveHistory': True
-                        }
-                    }
-                    try:
-                        result = users_collection.insert_one(new_user)
-                        add_system_log(f"New user created with ID: {result.inserted_id} - {userinfo.get('email', 'No email')}")
-                    except Exception as insert_exc:
-                        add_system_log(f"CRITICAL: Failed to insert new user: {str(insert_exc)}", "ERROR")
-                        return redirect('/login?error=user_creation_failed')
+                if user is None:
+                    add_system_log(f"New user created: {auth0_id} - {userinfo.get('email', 'No email')}")
                 else:
-                    # Update existing user - determine which field names to use based on existing data
-                    updates = {
-                        'lastLogin': timestamp_now,   # Use matching db format
-                        'lastActive': timestamp_now,  # Add for admin panel compatibility
-                        # Always ensure user_id exists
-                        'user_id': auth0_id
-                    }
-                    
-                    # Update name and email if provided
-                    if userinfo.get('name'):
-                        updates['name'] = userinfo.get('name')
-                    if userinfo.get('email'):
-                        updates['email'] = userinfo.get('email')
-                        
-                    # Add missing fields if they don't exist (subscription and usage count removed)
+                    # Older records may predate preferences or usernames
+                    repairs = {}
                     if 'preferences' not in user:
-                        updates['preferences'] = {
+                        repairs['preferences'] = {
                             'defaultTone': 'casual',
                             'saveHistory': True
                         }
-                    
-                    # Check if username is missing and add one if needed
-                    if 'username' not in user or not user.get('username'):
-                        email = userinfo.get('email', '')
-                        name = userinfo.get('name', '')
-                        
-                        if email:
-                            username_base = email.split('@')[0].replace('.', '').lower()
-                        elif name:
-                            username_base = name.replace(' ', '').lower()
-                        
-                        # Add a random number to ensure uniqueness
-                        username = f"{username_base}_{random.randint(1000, 9999)}"
-                        updates['username'] = username
-                        add_system_log(f"Added missing username '{username}' to existing user")
-                    
-                    # Always update with the _id field for consistency
-                    users_collection.update_one(
-                        {'_id': user['_id']},
-                        {'$set': updates}
-                    )
-                    
-                    add_system_log(f"Updated user record for: {userinfo.get('email', 'No email')}")
+                    if not user.get('username'):
+                        repairs['username'] = generate_username(userinfo.get('email', ''), userinfo.get('name', ''))
+                        add_system_log(f"Added missing username '{repairs['username']}' to existing user")
+                    if repairs:
+                        users_collection.update_one({'_id': user['_id']}, {'$set': repairs})
+                        user_cache.invalidate(auth0_id)
+                        add_system_log(f"Updated user record for: {userinfo.get('email', 'No email')}")
             except Exception as e:
                 add_system_log(f"Error updating user record: {str(e)}", "ERROR")
         
@@ -1307,6 +1661,34 @@ def logout():
         # Just redirect to logout page
         return redirect('/logout')
 
+# Rendered downloads are cached on local disk by content address (text, format
+# and renderer version), so repeat downloads of the same text skip rendering
+RENDER_CACHE_DIR = os.path.abspath(os.getenv('RENDER_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'mrwlah-render-cache')))
+RENDER_CACHE_MB = int(os.getenv('RENDER_CACHE_MB', 256))
+render_cache = DiskLRUCache(RENDER_CACHE_DIR, RENDER_CACHE_MB * 1024 * 1024)
+
+# A render ID names its exact bytes, so clients may keep it indefinitely
+RENDER_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+RENDER_ID_PATTERN = re.compile(r'^[0-9a-f]{64}\.(pdf|docx|odt)$')
+
+def rendered_document_response(source, render_id, conditional=False):
+    """send_file response for a rendered document, tagged with its render ID"""
+    format_type = RENDER_EXTENSIONS[render_id.rsplit('.', 1)[1]]
+    _, mimetype, extension = RENDER_FORMATS[format_type]
+    response = send_file(
+        source,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=f'mr-wlah-transformed.{extension}',
+        etag=render_id,
+        conditional=conditional
+    )
+    response.headers['Cache-Control'] = RENDER_CACHE_CONTROL
+    if render_cache.enabled:
+        # Where the same bytes can be re-fetched with GET (and Range requests)
+        response.headers['Content-Location'] = url_for('download_rendered_document', render_id=render_id)
+    return response
+
 @app.route('/api/document/generate', methods=['POST'])
 def generate_document():
     try:
@@ -1318,168 +1700,79 @@ def generate_document():
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         
-        # Generate document based on file type
-        if format_type == 'pdf':
-            return generate_pdf(text)
-        elif format_type == 'doc':
-            return generate_docx(text)
-        elif format_type == 'odt':
-            return generate_odt(text)
-        else:
+        if format_type not in RENDER_FORMATS:
             return jsonify({'error': f'Unsupported file type: {format_type}'}), 400
-    
-    except Exception as e:
-        error_msg = f"Error generating document: {str(e)}"
-        print(error_msg)
-        add_system_log(error_msg, "ERROR")
-        return jsonify({'error': 'Failed to generate document'}), 500
-
-def generate_pdf(text):
-    """Generate a PDF document from text"""
-    try:
-        # Create a bytes buffer for the PDF
-        buffer = io.BytesIO()
-        
-        # Create the PDF with ReportLab
-        pdf = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-        
-        # Set up font and margins
-        pdf.setFont("Helvetica", 12)
-        margin = 72  # 1 inch margins
-        text_width = width - 2 * margin
-        y_position = height - margin
-        
-        # Process the text and add to PDF
-        lines = text.split('\n')
-        for line in lines:
-            # Use ReportLab's wrap functionality to handle line breaks
-            text_object = pdf.beginText(margin, y_position)
-            text_object.setFont("Helvetica", 12)
-            
-            # If it's a blank line, move down
-            if not line.strip():
-                y_position -= 20
-                continue
-                
-            # Wrap text to fit within margins
-            wrapped_text = [line[i:i+80] for i in range(0, len(line), 80)]
-            
-            for wrap in wrapped_text:
-                text_object.textLine(wrap)
-                y_position -= 15
-                
-                # Check if we need a new page
-                if y_position < margin:
-                    pdf.drawText(text_object)
-                    pdf.showPage()
-                    pdf.setFont("Helvetica", 12)
-                    y_position = height - margin
-                    text_object = pdf.beginText(margin, y_position)
-                    text_object.setFont("Helvetica", 12)
-            
-            pdf.drawText(text_object)
         
-        # Save the PDF
-        pdf.save()
+        render_id = render_key(text, format_type)
         
-        # Move the buffer position to the beginning
-        buffer.seek(0)
+        # Werkzeug only evaluates conditional headers for GET and HEAD, so
+        # a POST that already has these bytes is answered here
+        if request.if_none_match.contains(render_id):
+            response = app.response_class(status=304)
+            response.set_etag(render_id)
+            response.headers['Cache-Control'] = RENDER_CACHE_CONTROL
+            return response
         
-        # Return the PDF as a response
-        return send_file(
-            buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name='mr-wlah-transformed.pdf'
-        )
+        cached_path = render_cache.lookup_path(render_id)
+        if cached_path is not None:
+            try:
+                return rendered_document_response(cached_path, render_id)
+            except FileNotFoundError:
+                cached_path = None  # Evicted by another worker in the meantime; render again
+        
+        # Rendering is CPU-bound, so it runs on the shared render pool. The
+        # worker writes straight into the cache directory when there is one.
+        try:
+            rendered_path = render_in_pool(text, format_type, RENDER_CACHE_DIR if render_cache.enabled else None)
+        except RenderQueueFull as e:
+            add_system_log(f"Render queue full, turned away a {format_type} download", "WARNING")
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        except Exception as e:
+            error_msg = f"{format_type.upper()} generation error: {str(e)}"
+            add_system_log(error_msg, "ERROR")
+            return jsonify({'error': error_msg}), 500
+        
+        cached_path = None
+        try:
+            cached_path = render_cache.adopt(render_id, rendered_path)
+        except OSError as e:
+            add_system_log(f"Failed to cache rendered document {render_id}: {str(e)}", "WARNING")
+            # Eviction can fail after the file was already moved into the cache
+            if not os.path.exists(rendered_path) and os.path.exists(render_cache.path_for(render_id)):
+                cached_path = render_cache.path_for(render_id)
+        if cached_path is not None:
+            return rendered_document_response(cached_path, render_id)
+        
+        # Not cached: hand the bytes over and remove the worker's file
+        try:
+            with open(rendered_path, 'rb') as f:
+                document = f.read()
+        finally:
+            os.unlink(rendered_path)
+        return rendered_document_response(io.BytesIO(document), render_id)
     
     except Exception as e:
-        error_msg = f"PDF generation error: {str(e)}"
+        error_msg = f"Error generating document: {str(e)}"
+        print(error_msg)
         add_system_log(error_msg, "ERROR")
-        return jsonify({'error': error_msg}), 500
+        return jsonify({'error': 'Failed to generate document'}), 500
 
-def generate_docx(text):
-    """Generate a DOCX document from text"""
-    try:
-        # Create a new Document
-        doc = docx.Document()
-        
-        # Add title
-        title = doc.add_heading('Mr. Wlah Transformed Text', 0)
-        title.alignment = 1  # Center alignment
-        
-        # Add paragraphs
-        paragraphs = text.split('\n\n')
-        for para in paragraphs:
-            if para.strip():
-                p = doc.add_paragraph()
-                p.add_run(para).font.size = Pt(12)
-        
-        # Save to a BytesIO object
-        buffer = io.BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
-        
-        # Return the document as a response
-        return send_file(
-            buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            as_attachment=True,
-            download_name='mr-wlah-transformed.docx'
-        )
+@app.route('/api/document/download/<render_id>', methods=['GET'])
+def download_rendered_document(render_id):
+    """Serve a cached render by ID, with If-None-Match and Range support"""
+    if not RENDER_ID_PATTERN.match(render_id):
+        return jsonify({'error': 'Invalid document ID'}), 404
     
-    except Exception as e:
-        error_msg = f"DOCX generation error: {str(e)}"
-        add_system_log(error_msg, "ERROR")
-        return jsonify({'error': error_msg}), 500
-
-def generate_odt(text):
-    """Generate an ODT document from text"""
+    path = render_cache.lookup_path(render_id)
     try:
-        # For ODT format, we'll convert from DOCX
-        # First create a DOCX document
-        doc = docx.Document()
-        
-        # Add title
-        title = doc.add_heading('Mr. Wlah Transformed Text', 0)
-        title.alignment = 1  # Center alignment
-        
-        # Add paragraphs
-        paragraphs = text.split('\n\n')
-        for para in paragraphs:
-            if para.strip():
-                p = doc.add_paragraph()
-                p.add_run(para).font.size = Pt(12)
-        
-        # Save to a temporary file
-        temp_docx = tempfile.NamedTemporaryFile(delete=False, suffix='.docx')
-        doc.save(temp_docx.name)
-        temp_docx.close()
-        
-        # Use a third-party conversion like LibreOffice (in a production environment)
-        # For this implementation, we'll return a DOCX file with a message
-        with open(temp_docx.name, 'rb') as file:
-            docx_data = file.read()
-        
-        # Clean up the temporary file
-        os.unlink(temp_docx.name)
-        
-        # Prepare the response
-        buffer = io.BytesIO(docx_data)
-        
-        # Return the document
-        return send_file(
-            buffer,
-            mimetype='application/vnd.oasis.opendocument.text',
-            as_attachment=True,
-            download_name='mr-wlah-transformed.odt'
-        )
-    
-    except Exception as e:
-        error_msg = f"ODT generation error: {str(e)}"
-        add_system_log(error_msg, "ERROR")
-        return jsonify({'error': error_msg}), 500
+        if path is None:
+            raise FileNotFoundError(render_id)
+        return rendered_document_response(path, render_id, conditional=True)
+    except FileNotFoundError:
+        # Evicted (possibly by another worker); the client has to generate it again
+        return jsonify({'error': 'Document is no longer cached, please generate it again'}), 404
 
 @app.route('/api/auth/status')
 def auth_status():
@@ -1560,72 +1853,108 @@ def test_users_collection():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-# Add this function before the main block
-def migrate_existing_users():
+USER_DEFAULTS_MIGRATION = 'backfill-user-defaults'
+
+# (step name, filter matching users that need it, update); pipeline updates
+# are evaluated by the server, so no user document is read by the app.
+# user_id itself is backfilled earlier, by migrate_schema.py.
+USER_DEFAULTS_STEPS = [
+    (
+        'lastActive',
+        {'lastActive': {'$exists': False}, 'lastLogin': {'$exists': True}},
+        [{'$set': {'lastActive': '$lastLogin'}}]
+    ),
+    (
+        # Older records hold the client's ISO string; the admin list pages on
+        # lastActive and only dates compare with its cursor. Unparseable
+        # strings become null, which sorts last.
+        'lastActiveDates',
+        {'lastActive': {'$type': 'string'}},
+        [{'$set': {'lastActive': {'$convert': {'input': '$lastActive', 'to': 'date', 'onError': None}}}}]
+    ),
+    (
+        # Login times used to be written with the host's local clock. $max
+        # against UTC can't move a value that is still in the future, so
+        # clamp those to now; older local times are already behind UTC.
+        'lastLoginUtc',
+        {'$expr': {'$gt': ['$lastLogin', '$$NOW']}},
+        [{'$set': {'lastLogin': '$$NOW'}}]
+    ),
+    (
+        'lastActiveUtc',
+        {'$expr': {'$gt': ['$lastActive', '$$NOW']}},
+        [{'$set': {'lastActive': '$$NOW'}}]
+    ),
+    (
+        'preferences',
+        {'preferences': {'$exists': False}},
+        {'$set': {'preferences': {'defaultTone': 'casual', 'saveHistory': True}}}
+    ),
+]
+
+def migrate_existing_users(force=False):
     """
-    Migrate existing users to ensure they have the required fields.
-    This function should run once at application startup.
+    Backfill required fields on existing users with one update_many per
+    step. Each step is recorded in the `migrations` collection once applied
+    and skipped after that, so steps added later still run exactly once;
+    every step only matches users still needing it, so rerunning one (or
+    racing another run) is harmless.
     """
     if users_collection is None:
         add_system_log("No database connection, skipping user migration", "WARNING")
         return False
     
     try:
-        # Find all users
-        users = list(users_collection.find())
-        
-        if not users:
-            add_system_log("No users to migrate", "INFO")
+        record = migrations_collection.find_one({'_id': USER_DEFAULTS_MIGRATION}) or {}
+        applied = set() if force else set(record.get('steps', {}))
+        pending_steps = [step for step in USER_DEFAULTS_STEPS if step[0] not in applied]
+        if not pending_steps:
+            add_system_log(f"User migration '{USER_DEFAULTS_MIGRATION}' already applied", "INFO")
             return True
         
-        add_system_log(f"Found {len(users)} users to check for migration", "INFO")
-        
-        migrated_count = 0
-        for user in users:
-            updates = {}
-            
-            # Ensure user_id field exists and is prioritized
-            # First check if user has an auth0Id but no user_id
-            if 'auth0Id' in user and 'user_id' not in user:
-                updates['user_id'] = user['auth0Id']
-            # Also handle auth0_id field (with underscore)
-            elif 'auth0_id' in user and 'user_id' not in user:
-                updates['user_id'] = user['auth0_id']
-            # If neither field exists, create a placeholder user_id
-            elif 'user_id' not in user:
-                updates['user_id'] = str(user['_id'])  # Use MongoDB _id as a fallback
-                updates['auth0Id'] = str(user['_id'])  # Set auth0Id too for consistency
-            
-            # Ensure other required fields
-            if 'lastActive' not in user and 'lastLogin' in user:
-                updates['lastActive'] = user['lastLogin']
-            
-            # Subscription and usage count fields removed
-            
-            if 'preferences' not in user:
-                updates['preferences'] = {
-                    'defaultTone': 'casual',
-                    'saveHistory': True
-                }
-            
-            # If we need to update the user
-            if updates:
-                users_collection.update_one(
-                    {'_id': user['_id']},
-                    {'$set': updates}
-                )
-                migrated_count += 1
+        now = datetime.datetime.utcnow()
+        migrations_collection.update_one(
+            {'_id': USER_DEFAULTS_MIGRATION},
+            {'$set': {'status': 'running', 'updatedAt': now}, '$setOnInsert': {'createdAt': now}},
+            upsert=True
+        )
         
-        if migrated_count > 0:
-            add_system_log(f"Migrated {migrated_count} users to new format", "INFO")
+        modified = {}
+        for step, pending, update in pending_steps:
+            result = users_collection.update_many(pending, update)
+            modified[step] = result.modified_count
+            migrations_collection.update_one({'_id': USER_DEFAULTS_MIGRATION}, {'$set': {
+                f'steps.{step}': {'modified': result.modified_count, 'appliedAt': datetime.datetime.utcnow()}
+            }})
+        
+        migrations_collection.update_one({'_id': USER_DEFAULTS_MIGRATION}, {'$set': {
+            'status': 'complete',
+            'completedAt': datetime.datetime.utcnow()
+        }})
+        
+        if any(modified.values()):
+            summary = ', '.join(f"{step}: {count}" for step, count in modified.items())
+            add_system_log(f"Migrated users to new format ({summary})", "INFO")
         else:
             add_system_log("All users are already in the correct format", "INFO")
         
         return True
     except Exception as e:
         add_system_log(f"Error migrating users: {str(e)}", "ERROR")
+        if migrations_collection is not None:
+            migrations_collection.update_one(
+                {'_id': USER_DEFAULTS_MIGRATION},
+                {'$set': {'status': 'failed', 'updatedAt': datetime.datetime.utcnow()}}
+            )
         return False
 
+@app.cli.command('migrate-users')
+@click.option('--force', is_flag=True, help='Run every step again, even those recorded as applied')
+def migrate_users_command(force):
+    """Backfill required fields on existing user records."""
+    if not migrate_existing_users(force=force):
+        sys.exit(1)
+
 if __name__ == '__main__':
     try:
         app.jinja_env.auto_reload = True
@@ -1651,9 +1980,6 @@ if __name__ == '__main__':
                 except Exception as e:
                     db_status += f" (error counting transformations: {str(e)})"
             add_system_log(db_status, "INFO")
-            
-            # Migrate existing users to new format
-            migrate_existing_users()
         else:
             add_system_log("Running without database connection", "WARNING")
         
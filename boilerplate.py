@@ -0,0 +1,174 @@
+"""
+Page Boilerplate Stripping for Mr. Wlah
+
+Text extracted from PDFs carries "--- Page N ---" markers and repeats the
+same running headers, footers and page numbers on every page. None of that
+is worth sending to Gemini, so it is stripped before prompting. Page breaks
+can optionally be kept as compact markers and turned back into page
+headings once the transformed text comes back.
+"""
+
+import math
+import re
+from collections import Counter
+
+from extraction import CHARS_PER_TOKEN, PDF_PAGE_MARKER_PATTERN as PAGE_MARKER_PATTERN
+
+# Compact markers that stand in for page breaks inside the prompt
+COMPACT_PAGE_MARKER_PATTERN = re.compile(r'⟦PAGE (\d+)⟧')
+
+ROMAN_NUMERAL = r'(?=[ivxlcdm])m{0,3}(?:cm|cd|d?c{0,3})(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3})'
+
+# Labelled page numbers: "Page 12", "Page 12 of 40", "Page xiv"
+LABELLED_PAGE_NUMBER_PATTERN = re.compile(
+    r'^[\s\-–—|]*page\s*(?:\d+|' + ROMAN_NUMERAL + r')(?:\s*(?:of|/)\s*\d+)?[\s\-–—|]*$',
+    re.IGNORECASE
+)
+
+# Bare page numbers: "12", "- 12 -", "12 / 40", "xiv". Table values, years
+# and words like "I", "Mix" or "CD" look the same, so these only count as
+# page numbers when their offset from the page's own number recurs on
+# enough pages (see find_page_number_offsets)
+BARE_PAGE_NUMBER_PATTERN = re.compile(
+    r'^[\s\-–—|]*(?:(\d+)|(' + ROMAN_NUMERAL + r'))(?:\s*(?:of|/)\s*\d+)?[\s\-–—|]*$',
+    re.IGNORECASE
+)
+
+ROMAN_VALUES = {'i': 1, 'v': 5, 'x': 10, 'l': 50, 'c': 100, 'd': 500, 'm': 1000}
+
+DIGITS_PATTERN = re.compile(r'\d+')
+
+# Running headers and footers are short; only lines up to this length have
+# their numbers masked, so longer body lines must repeat exactly to match
+FURNITURE_MAX_CHARS = 60
+
+# Headers and footers are only looked for this many lines from a page's edges
+EDGE_LINES = 3
+
+# A line is boilerplate when it recurs on at least this share of pages
+# (and on at least MIN_REPEAT_PAGES of them)
+MIN_REPEAT_SHARE = 0.5
+MIN_REPEAT_PAGES = 3
+
+
+def split_pages(text):
+    """
+    Split text with page markers into (preamble, [(page_number, page_text)]).
+    Returns None when the text has no page markers.
+    """
+    markers = list(PAGE_MARKER_PATTERN.finditer(text))
+    if not markers:
+        return None
+
+    pages = []
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        pages.append((int(marker.group(1)), text[marker.end():end].strip('\n')))
+    return text[:markers[0].start()], pages
+
+
+def normalize_line(line):
+    """Key for the frequency index: case and spacing folded, numbers masked in short lines"""
+    key = ' '.join(line.split()).lower()
+    return DIGITS_PATTERN.sub('#', key) if len(key) <= FURNITURE_MAX_CHARS else key
+
+
+def edge_indexes(line_count):
+    """Indexes of the lines near the top and bottom of a page"""
+    return set(range(min(EDGE_LINES, line_count))) | set(range(max(line_count - EDGE_LINES, 0), line_count))
+
+
+def find_repeated_lines(page_lines):
+    """Frequency index of edge lines; returns the normalized lines seen on enough pages"""
+    counts = Counter()
+    for lines in page_lines:
+        counts.update({normalize_line(lines[i]) for i in edge_indexes(len(lines)) if lines[i].strip()})
+
+    threshold = repeat_threshold(len(page_lines))
+    return {line for line, count in counts.items() if count >= threshold}
+
+
+def repeat_threshold(page_count):
+    return max(MIN_REPEAT_PAGES, math.ceil(page_count * MIN_REPEAT_SHARE))
+
+
+def roman_value(numeral):
+    values = [ROMAN_VALUES[letter] for letter in numeral.lower()]
+    return sum(-value if value < following else value for value, following in zip(values, values[1:] + [0]))
+
+
+def bare_page_number(line):
+    """The value of a bare page number line (arabic or roman), or None"""
+    match = BARE_PAGE_NUMBER_PATTERN.match(line)
+    if not match or not line.strip():
+        return None
+    return int(match.group(1)) if match.group(1) else roman_value(match.group(2))
+
+
+def find_page_number_offsets(pages, page_lines):
+    """
+    Offsets between printed and actual page numbers shared by enough pages.
+    Printed numbers rise in step with the pages, so a real sequence gives
+    the same offset on every page while a stray "350" or "1991" does not.
+    """
+    counts = Counter()
+    for (page_number, _), lines in zip(pages, page_lines):
+        values = (bare_page_number(lines[i]) for i in edge_indexes(len(lines)))
+        counts.update({value - page_number for value in values if value is not None})
+
+    threshold = repeat_threshold(len(page_lines))
+    return {offset for offset, count in counts.items() if count >= threshold}
+
+
+def is_furniture(line, page_number, repeated, offsets):
+    """Whether an edge line is a running header/footer or page number"""
+    value = bare_page_number(line)
+    if value is not None:
+        # Masked digits would make every bare number look repeated, so
+        # these are judged by their offset alone
+        return value - page_number in offsets
+    return normalize_line(line) in repeated or bool(LABELLED_PAGE_NUMBER_PATTERN.match(line))
+
+
+def strip_boilerplate(text, keep_pages=False):
+    """
+    Remove page markers, repeated headers/footers and page numbers from
+    paged text. With keep_pages, each page starts with a compact ⟦PAGE n⟧
+    marker that restore_page_markers turns back into a page heading.
+    Returns (text, stats) where stats reports what was saved.
+    """
+    stats = {'linesRemoved': 0, 'charsSaved': 0, 'tokensSaved': 0}
+    split = split_pages(text)
+    if split is None:
+        return text, stats
+
+    preamble, pages = split
+    page_lines = [page_text.split('\n') for _, page_text in pages]
+    repeated = find_repeated_lines(page_lines) if len(pages) >= MIN_REPEAT_PAGES else set()
+    offsets = find_page_number_offsets(pages, page_lines) if len(pages) >= MIN_REPEAT_PAGES else set()
+
+    parts = [preamble.strip()] if preamble.strip() else []
+    for (page_number, _), lines in zip(pages, page_lines):
+        edges = edge_indexes(len(lines))
+        kept = []
+        for i, line in enumerate(lines):
+            if i in edges and line.strip() and is_furniture(line, page_number, repeated, offsets):
+                stats['linesRemoved'] += 1
+                continue
+            kept.append(line)
+
+        body = '\n'.join(kept).strip()
+        if keep_pages:
+            parts.append(f'⟦PAGE {page_number}⟧\n{body}'.rstrip())
+        elif body:
+            parts.append(body)
+
+    stripped = '\n\n'.join(parts)
+    stats['charsSaved'] = max(len(text) - len(stripped), 0)
+    stats['tokensSaved'] = stats['charsSaved'] // CHARS_PER_TOKEN
+    return stripped, stats
+
+
+def restore_page_markers(text):
+    """Turn compact ⟦PAGE n⟧ markers back into "--- Page n ---" headings"""
+    return COMPACT_PAGE_MARKER_PATTERN.sub(lambda match: f'--- Page {match.group(1)} ---', text)
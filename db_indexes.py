@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+MongoDB Index Definitions for Mr. Wlah
+
+Every index the app relies on is declared here, next to the hot queries it
+exists to serve. Run this module at deploy time to reconcile a database with
+the declarations:
+
+    python db_indexes.py              # create missing indexes
+    python db_indexes.py --dry-run    # only report differences
+    python db_indexes.py --drop-extra # also drop undeclared indexes
+
+The app verifies the declarations at startup, and test_query_plans.py runs
+explain() on every hot query against a local mongod to catch collection scans.
+"""
+
+import argparse
+import datetime
+import os
+import sys
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import PyMongoError
+from pymongo.server_api import ServerApi
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_MONGODB_URI = "mongodb+srv://benchai.3cq4b8o.mongodb.net/?authSource=%24external&authMechanism=MONGODB-X509&retryWrites=true&w=majority&appName=MrWlah"
+CERT_PATH = os.path.join('certs', 'X509-cert-5870665680541743449.pem')
+
+# Index options that change behaviour; an existing index with the same keys
+# but different values for these has to be rebuilt
+SIGNIFICANT_OPTIONS = ('unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression')
+
+INDEX_SPECS = {
+    'users': [
+        # Login callback, record_transformation and admin lookups; unique so
+        # concurrent first logins can't create two records
+        IndexModel([('user_id', ASCENDING)], name='user_id_1', unique=True),
+        # Not queried; its unique constraint guards against duplicate accounts
+        IndexModel([('auth0Id', ASCENDING)], name='auth0Id_1', unique=True),
+        IndexModel([('email', ASCENDING)], name='email_1'),
+        IndexModel([('name', TEXT)], name='name_text'),
+        # Admin user list pages, most recently active first with _id breaking
+        # ties; also the "recent users" filter
+        IndexModel([('lastActive', DESCENDING), ('_id', DESCENDING)], name='lastActive_-1__id_-1'),
+    ],
+    'transformations': [
+        # History pages, newest first with _id breaking ties, and exports
+        IndexModel([('user_id', ASCENDING), ('createdAt', DESCENDING), ('_id', DESCENDING)],
+                   name='user_id_1_createdAt_-1__id_-1'),
+        IndexModel([('createdAt', DESCENDING)], name='createdAt_-1'),
+        IndexModel([('tone', ASCENDING)], name='tone_1'),
+    ],
+    'apiUsage': [
+        # One bucket per user per day; also serves a user's usage over a date range
+        IndexModel([('user_id', ASCENDING), ('date', DESCENDING)], name='user_id_1_date_-1', unique=True),
+        IndexModel([('date', DESCENDING)], name='date_-1'),
+    ],
+    'documents': [
+        # Uploaded text expires at expiresAt
+        IndexModel([('expiresAt', ASCENDING)], name='expiresAt_1', expireAfterSeconds=0),
+    ],
+    'logs': [
+        IndexModel([('timestamp', DESCENDING)], name='timestamp_-1'),
+        IndexModel([('level', ASCENDING)], name='level_1'),
+        IndexModel([('userId', ASCENDING)], name='userId_1'),
+        IndexModel([('source', ASCENDING)], name='source_1'),
+    ],
+}
+
+# Queries on request paths, with placeholder values. Each must be answered
+# from an index; test_query_plans.py fails on any COLLSCAN.
+HOT_USER_ID = 'auth0|hot-query'
+
+HOT_QUERIES = [
+    {
+        'name': 'user by user_id (callback, record_transformation, admin login)',
+        'collection': 'users',
+        'filter': {'user_id': HOT_USER_ID},
+    },
+    {
+        'name': 'admin recent users by ID',
+        'collection': 'users',
+        'filter': {'user_id': HOT_USER_ID, 'lastActive': {'$gte': datetime.datetime(2000, 1, 1)}},
+        'sort': [('lastActive', -1), ('_id', -1)],
+        'limit': 51,
+    },
+    {
+        'name': 'admin recent users',
+        'collection': 'users',
+        'filter': {'lastActive': {'$gte': datetime.datetime(2000, 1, 1)}},
+        'sort': [('lastActive', -1), ('_id', -1)],
+        'limit': 51,
+    },
+    {
+        'name': 'admin user list, first page',
+        'collection': 'users',
+        'filter': {},
+        'sort': [('lastActive', -1), ('_id', -1)],
+        'limit': 51,
+    },
+    {
+        'name': 'admin user list, next page',
+        'collection': 'users',
+        'filter': {'$or': [
+            {'lastActive': {'$lt': datetime.datetime(2030, 1, 1)}},
+            {'lastActive': datetime.datetime(2030, 1, 1), '_id': {'$lt': ObjectId('f' * 24)}},
+            {'lastActive': None}
+        ]},
+        'sort': [('lastActive', -1), ('_id', -1)],
+        'limit': 51,
+    },
+    {
+        'name': 'transformation history, first page',
+        'collection': 'transformations',
+        'filter': {'user_id': HOT_USER_ID, 'createdAt': {'$type': 'date'}},
+        'sort': [('createdAt', -1), ('_id', -1)],
+        'limit': 21,
+    },
+    {
+        'name': 'transformation history, next page',
+        'collection': 'transformations',
+        'filter': {'$or': [
+            {'user_id': HOT_USER_ID, 'createdAt': {'$lt': datetime.datetime(2030, 1, 1)}},
+            {'user_id': HOT_USER_ID, 'createdAt': datetime.datetime(2030, 1, 1), '_id': {'$lt': ObjectId('f' * 24)}}
+        ]},
+        'sort': [('createdAt', -1), ('_id', -1)],
+        'limit': 21,
+    },
+    {
+        'name': 'transformation detail',
+        'collection': 'transformations',
+        'filter': {'_id': ObjectId('0' * 24), 'user_id': HOT_USER_ID},
+    },
+    {
+        'name': 'history export',
+        'collection': 'transformations',
+        'filter': {'_id': {'$in': [ObjectId('0' * 24)]}, 'user_id': HOT_USER_ID},
+        'sort': [('createdAt', -1)],
+    },
+    {
+        'name': 'daily usage bucket upsert',
+        'collection': 'apiUsage',
+        'filter': {'user_id': HOT_USER_ID, 'date': datetime.datetime(2030, 1, 1)},
+    },
+    {
+        'name': 'user usage over a date range',
+        'collection': 'apiUsage',
+        'filter': {'user_id': HOT_USER_ID, 'date': {'$gte': datetime.datetime(2030, 1, 1)}},
+        'sort': [('date', -1)],
+    },
+    {
+        'name': 'stored upload by documentId',
+        'collection': 'documents',
+        'filter': {'_id': 'hot-query', 'user_id': HOT_USER_ID},
+    },
+]
+
+
+def index_key(spec):
+    """Key pattern of a declared index as a tuple of (field, direction) pairs"""
+    return tuple((field, direction) for field, direction in spec['key'].items())
+
+
+def existing_index_key(info):
+    """
+    Key pattern of an index as reported by index_information(), in the same
+    form as index_key. Text indexes are reported as _fts/_ftsx with their
+    fields under weights, and some tools store directions as floats.
+    """
+    key = []
+    for field, direction in info['key']:
+        if field == '_fts':
+            key.extend((text_field, TEXT) for text_field in sorted(info.get('weights', {})))
+        elif field != '_ftsx':
+            key.append((field, int(direction) if isinstance(direction, float) else direction))
+    return tuple(key)
+
+
+def significant_options(spec):
+    return {option: spec[option] for option in SIGNIFICANT_OPTIONS if option in spec}
+
+
+def compare_indexes(collection, models):
+    """
+    Compare a collection's indexes with its declared models. Returns
+    (missing, conflicting, extra): models to create, (model, existing name)
+    pairs whose keys match but options differ, and undeclared index names.
+    Existing indexes are matched by key pattern, so a declared index that
+    already exists under another name is not rebuilt.
+    """
+    existing = {name: info for name, info in collection.index_information().items() if name != '_id_'}
+    by_key = {}
+    for name, info in existing.items():
+        by_key[existing_index_key(info)] = (name, info)
+
+    missing, conflicting = [], []
+    declared_names = set()
+    for model in models:
+        spec = model.document
+        match = by_key.get(index_key(spec))
+        if match is None:
+            missing.append(model)
+            continue
+        name, info = match
+        declared_names.add(name)
+        if significant_options(spec) != significant_options(info):
+            conflicting.append((model, name))
+
+    extra = sorted(name for name in existing if name not in declared_names)
+    return missing, conflicting, extra
+
+
+def ensure_collection_indexes(db, collection_name):
+    """Create any declared indexes missing from one collection; returns their names"""
+    missing, _, _ = compare_indexes(db[collection_name], INDEX_SPECS[collection_name])
+    if missing:
+        return db[collection_name].create_indexes(missing)
+    return []
+
+
+def rebuild_index(collection, model, existing_name, log=print):
+    """
+    Replace an index whose options differ from its declaration. MongoDB
+    won't keep two indexes on the same keys, so the old one has to go
+    before the new one is built; a stand-in on the same keys plus _id
+    serves queries meanwhile. If the build fails (e.g. duplicates under a
+    new unique constraint) the old index is restored before re-raising.
+    """
+    old = collection.index_information()[existing_name]
+    key = list(model.document['key'].items())
+    if any(field == '_id' for field, _ in key):
+        stand_in_key = key[:-1]
+    else:
+        stand_in_key = key + [('_id', ASCENDING)]
+    stand_in = f"{model.document['name']}_rebuild"
+    try:
+        collection.create_indexes([IndexModel(stand_in_key, name=stand_in)])
+    except PyMongoError as e:
+        # Typically an existing index already covers those keys
+        log(f"{collection.name}: no stand-in index for {existing_name} ({str(e)})")
+        stand_in = None
+
+    collection.drop_index(existing_name)
+    try:
+        collection.create_indexes([model])
+    except PyMongoError:
+        log(f"{collection.name}: building {model.document['name']} failed, restoring {existing_name}")
+        collection.create_indexes([IndexModel(list(existing_index_key(old)), name=existing_name,
+                                              **significant_options(old))])
+        raise
+    finally:
+        if stand_in:
+            collection.drop_index(stand_in)
+
+
+def reconcile_indexes(db, drop_extra=False, dry_run=False, log=print):
+    """
+    Bring every declared collection's indexes in line with INDEX_SPECS.
+    Conflicting indexes are rebuilt; undeclared ones are only reported
+    unless drop_extra is set. Returns True if nothing is left to fix.
+
+    Run it after migrate_schema.py: the unique user_id index can only be
+    built once every user has a user_id of its own.
+    """
+    clean = True
+    for collection_name, models in INDEX_SPECS.items():
+        collection = db[collection_name]
+        missing, conflicting, extra = compare_indexes(collection, models)
+
+        for model, existing_name in conflicting:
+            log(f"{collection_name}: {existing_name} has different options than declared")
+            if not dry_run:
+                rebuild_index(collection, model, existing_name, log=log)
+
+        for model in missing:
+            log(f"{collection_name}: {'missing' if dry_run else 'creating'} {model.document['name']}")
+        if missing and not dry_run:
+            collection.create_indexes(missing)
+
+        for name in extra:
+            if drop_extra and not dry_run:
+                log(f"{collection_name}: dropping undeclared index {name}")
+                collection.drop_index(name)
+            else:
+                log(f"{collection_name}: undeclared index {name}")
+
+        if dry_run and (missing or conflicting):
+            clean = False
+    return clean
+
+
+def verify_indexes(db):
+    """Names ("collection.index") of declared indexes that are missing or built with other options"""
+    problems = []
+    for collection_name, models in INDEX_SPECS.items():
+        missing, conflicting, _ = compare_indexes(db[collection_name], models)
+        problems.extend(f"{collection_name}.{model.document['name']}" for model in missing)
+        problems.extend(f"{collection_name}.{model.document['name']}" for model, _ in conflicting)
+    return problems
+
+
+def explain_hot_query(db, query):
+    """The winning plan for one of HOT_QUERIES"""
+    cursor = db[query['collection']].find(query['filter'])
+    if query.get('sort'):
+        cursor = cursor.sort(query['sort'])
+    if query.get('limit'):
+        cursor = cursor.limit(query['limit'])
+    return cursor.explain()['queryPlanner']['winningPlan']
+
+
+def plan_stages(plan):
+    """Every stage name in an explain() plan tree"""
+    if 'queryPlan' in plan:  # Slot-based engine output
+        plan = plan['queryPlan']
+    yield plan.get('stage')
+    if 'inputStage' in plan:
+        yield from plan_stages(plan['inputStage'])
+    for child in plan.get('inputStages', []):
+        yield from plan_stages(child)
+
+
+def connect(uri, database):
+    """Connect with the X.509 certificate when the URI asks for it"""
+    if 'MONGODB-X509' in uri:
+        cert_path = CERT_PATH
+        cert_content = os.getenv('MONGODB_CERT')
+        if cert_content:
+            import tempfile
+            cert_file = tempfile.NamedTemporaryFile(delete=False)
+            cert_file.write(cert_content.encode())
+            cert_file.close()
+            cert_path = cert_file.name
+        client = MongoClient(uri, tls=True, tlsCertificateKeyFile=cert_path, server_api=ServerApi('1'))
+    else:
+        client = MongoClient(uri)
+    return client[database]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile MongoDB indexes with the declared specs")
+    parser.add_argument('--uri', default=os.getenv('MONGODB_URI', DEFAULT_MONGODB_URI), help='MongoDB connection URI')
+    parser.add_argument('--database', default=os.getenv('MONGODB_DATABASE', 'benchai'), help='Database name')
+    parser.add_argument('--dry-run', action='store_true', help='Only report differences')
+    parser.add_argument('--drop-extra', action='store_true', help='Drop indexes that are not declared')
+    args = parser.parse_args()
+
+    try:
+        db = connect(args.uri, args.database)
+        clean = reconcile_indexes(db, drop_extra=args.drop_extra, dry_run=args.dry_run)
+    except Exception as e:
+        print(f"❌ Index reconciliation failed: {str(e)}")
+        return 1
+
+    print("✅ Indexes match the declared specs" if clean else "❌ Indexes differ from the declared specs")
+    return 0 if clean else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Disk-Backed LRU Cache for Mr. Wlah
+
+A small content-addressed cache shared by every worker process on a host.
+Entries are plain files named by key; reads bump the file's mtime and the
+oldest entries are evicted once the directory grows past its size budget.
+"""
+
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_stream(stream, *extra):
+    """
+    SHA-256 of a seekable stream's contents plus any extra key parts.
+    The stream is read in chunks (or memory-mapped when it is a real file)
+    and rewound afterwards.
+    """
+    digest = hashlib.sha256()
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, OSError):
+        fileno = None
+
+    if fileno is not None and os.fstat(fileno).st_size:
+        # File-backed uploads are hashed straight from a memory map
+        stream.flush()
+        with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+            digest.update(mapped)
+    else:
+        stream.seek(0)
+        for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    stream.seek(0)
+
+    for part in extra:
+        digest.update(b'\0' + str(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class DiskLRUCache:
+    """Bytes cache stored as one file per key with least-recently-used eviction"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Size is rescanned from disk whenever this estimate passes the budget,
+        # since other worker processes write to the same directory
+        self._estimated_bytes = None
+
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return the cached bytes for key, or None"""
+        if not self.enabled:
+            return None
+
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return data
+
+    def lookup_path(self, key):
+        """Return the path of the cached file for key, or None; lets large entries be served without reading them"""
+        if not self.enabled:
+            return None
+
+        path = self.path_for(key)
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def set(self, key, data):
+        """Store bytes under key, evicting old entries if over budget"""
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+
+        # Write to a temp file first so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self.path_for(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        self._account(len(data))
+
+    def adopt(self, key, temp_path):
+        """
+        Move a finished file into the cache under key and return its new path.
+        temp_path must be in the cache directory and named with the .tmp-
+        prefix. Returns None (leaving the file alone) if it is over budget.
+        """
+        size = os.path.getsize(temp_path)
+        if not self.enabled or size > self.max_bytes:
+            return None
+
+        path = self.path_for(key)
+        os.replace(temp_path, path)
+        self._account(size)
+        return path
+
+    def _account(self, size):
+        """Add a new entry's size to the estimate, evicting once it passes the budget"""
+        with self._lock:
+            if self._estimated_bytes is None or self._estimated_bytes + size > self.max_bytes:
+                self._estimated_bytes = self.evict()
+            else:
+                self._estimated_bytes += size
+
+    def evict(self):
+        """Delete least recently used entries until under budget; returns the new size"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+        return total
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': round(self.hits / lookups, 3) if lookups else None,
+            'maxBytes': self.max_bytes
+        }
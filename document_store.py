@@ -0,0 +1,79 @@
+"""
+Uploaded Document Store for Mr. Wlah
+
+Text extracted from an upload is kept server-side for a limited time and
+referenced by ID, so the browser sends a document to the server once and
+transforms point back at it instead of posting the text again.
+
+Documents live in a MongoDB collection whose TTL index (declared in
+db_indexes.py) expires them, or in a bounded in-process dictionary when the
+app runs in demo mode without a database.
+"""
+
+import datetime
+import threading
+import uuid
+from collections import OrderedDict
+
+from pymongo.errors import DocumentTooLarge, PyMongoError
+
+
+class DocumentStore:
+    """Short-lived, per-user storage for extracted upload text"""
+
+    def __init__(self, collection=None, ttl_seconds=3600, max_memory_documents=64):
+        self.collection = collection
+        self.ttl = datetime.timedelta(seconds=ttl_seconds)
+        self.max_memory_documents = max_memory_documents
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, user_id, text, filename=None, truncated=False):
+        """
+        Store extracted text for user_id and return its document ID, or None
+        if it could not be stored (the caller then falls back to sending the
+        text to the browser).
+        """
+        now = datetime.datetime.utcnow()
+        document = {
+            '_id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'filename': filename,
+            'text': text,
+            'truncated': truncated,
+            'characterCount': len(text),
+            'wordCount': len(text.split()),
+            'createdAt': now,
+            'expiresAt': now + self.ttl
+        }
+
+        if self.collection is None:
+            with self._lock:
+                self._memory[document['_id']] = document
+                while len(self._memory) > self.max_memory_documents:
+                    self._memory.popitem(last=False)
+            return document['_id']
+
+        try:
+            self.collection.insert_one(document)
+        except (DocumentTooLarge, PyMongoError):
+            return None
+        return document['_id']
+
+    def get(self, document_id, user_id):
+        """Return the stored document if it exists, belongs to user_id and has not expired"""
+        if not isinstance(document_id, str):
+            return None
+
+        if self.collection is None:
+            with self._lock:
+                document = self._memory.get(document_id)
+        else:
+            document = self.collection.find_one({'_id': document_id, 'user_id': user_id})
+
+        # The TTL monitor only runs about once a minute, so check expiry here too
+        if not document or document['user_id'] != user_id:
+            return None
+        if document['expiresAt'] <= datetime.datetime.utcnow():
+            return None
+        return document
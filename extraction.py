@@ -0,0 +1,608 @@
+"""
+Document Text Extraction for Mr. Wlah
+
+Streaming helpers for pulling text out of uploaded documents. PDF pages are
+yielded one at a time so callers can stop early once they have enough text.
+
+PDF and DOCX parsing runs on a process pool shared by the app. Workers are
+sandboxed with a memory cap and a wall-clock limit, so a malformed or huge
+upload fails on its own instead of taking a web worker down with it. This
+module only imports PyPDF2 and the standard library so pool workers start
+quickly; DOCX files are read straight from their XML.
+"""
+
+import codecs
+import itertools
+import mmap
+import multiprocessing
+import os
+import re
+import signal
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree import ElementTree
+
+import PyPDF2
+from dotenv import load_dotenv
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Load environment variables
+load_dotenv()
+
+# Bump whenever extracted output changes so cached extractions are not reused
+EXTRACTOR_VERSION = 2
+
+# Rough characters-per-token ratio used to turn token budgets into characters
+CHARS_PER_TOKEN = 4
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# The markers join_pdf_pages puts between pages
+PDF_PAGE_MARKER_PATTERN = re.compile(r'^--- Page (\d+) ---$\n?', re.MULTILINE)
+
+# Byte order marks, longest first since the UTF-32 LE BOM starts with UTF-16 LE's
+TEXT_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+TEXT_FALLBACK_ENCODING = 'cp1252'
+TEXT_CHUNK_SIZE = 64 * 1024
+
+# WordprocessingML elements read by the streaming DOCX extractor
+DOCX_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DOCX_BODY = DOCX_NAMESPACE + 'body'
+DOCX_PARAGRAPH = DOCX_NAMESPACE + 'p'
+DOCX_TEXT = DOCX_NAMESPACE + 't'
+DOCX_TAB = DOCX_NAMESPACE + 'tab'
+DOCX_BREAKS = {DOCX_NAMESPACE + 'br', DOCX_NAMESPACE + 'cr'}
+DOCX_TABLE = DOCX_NAMESPACE + 'tbl'
+DOCX_ROW = DOCX_NAMESPACE + 'tr'
+DOCX_CELL = DOCX_NAMESPACE + 'tc'
+
+# Process pool settings
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', 0)) or os.cpu_count() or 1
+PAGES_PER_TASK = int(os.getenv('EXTRACTION_PAGES_PER_TASK', 20))
+
+# Sandbox limits for each pool worker
+EXTRACTION_WORKER_MEMORY_MB = int(os.getenv('EXTRACTION_WORKER_MEMORY_MB', 1024))
+EXTRACTION_TASK_TIMEOUT = float(os.getenv('EXTRACTION_TASK_TIMEOUT', 30))
+EXTRACTION_TIMEOUT_GRACE = 5
+
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+# Which task each pool worker is running and since when, shared with the
+# workers so a task's deadline runs from its start rather than its submission
+_task_slots = None
+_task_ids = itertools.count(1)
+
+# Set in each pool worker by init_extraction_worker
+_worker_slot = None
+
+
+def parse_page_range(spec):
+    """
+    Parse a page selection like "1-3,7,10-" into a list of 1-based
+    (first, last) tuples. An open-ended range has last set to None.
+    Raises ValueError for malformed selections.
+    """
+    ranges = []
+    for part in str(spec).split(','):
+        part = part.strip()
+        if not part:
+            continue
+
+        first, dash, last = part.partition('-')
+        try:
+            first = int(first) if first.strip() else 1
+            last = (int(last) if last.strip() else None) if dash else first
+        except ValueError:
+            raise ValueError(f"Invalid page range: {part}")
+
+        if first < 1 or (last is not None and last < first):
+            raise ValueError(f"Invalid page range: {part}")
+        ranges.append((first, last))
+
+    if not ranges:
+        raise ValueError("Empty page range")
+    return ranges
+
+
+def resolve_page_numbers(page_ranges, total_pages):
+    """Turn parsed page ranges into sorted, de-duplicated 0-based page indexes"""
+    if not page_ranges:
+        return range(total_pages)
+
+    indexes = set()
+    for first, last in page_ranges:
+        last = total_pages if last is None else min(last, total_pages)
+        indexes.update(range(first - 1, last))
+    return sorted(indexes)
+
+
+def detect_text_encoding(head):
+    """Pick an encoding from the leading bytes: a BOM if present, otherwise UTF-8"""
+    for bom, encoding in TEXT_BOMS:
+        if head.startswith(bom):
+            return encoding
+    return 'utf-8'
+
+
+def decode_text_chunks(stream, encoding, errors='strict', max_chars=None):
+    """Incrementally decode a byte stream, stopping at max_chars. Returns (text, truncated)"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    parts = []
+    collected = 0
+
+    for chunk in iter(lambda: stream.read(TEXT_CHUNK_SIZE), b''):
+        text = decoder.decode(chunk)
+        if max_chars is not None and collected + len(text) > max_chars:
+            parts.append(text[:max_chars - collected])
+            return ''.join(parts), True
+        parts.append(text)
+        collected += len(text)
+
+    parts.append(decoder.decode(b'', final=True))
+    return ''.join(parts), False
+
+
+def decode_text_stream(stream, max_chars=None):
+    """
+    Decode an uploaded text file chunk by chunk. BOMs select UTF-8/16/32;
+    files that are not valid UTF-8 are re-read as Windows-1252.
+    Returns (text, truncated).
+    """
+    stream.seek(0)
+    encoding = detect_text_encoding(stream.read(4))
+    stream.seek(0)
+    try:
+        return decode_text_chunks(stream, encoding, max_chars=max_chars)
+    except UnicodeDecodeError:
+        stream.seek(0)
+        return decode_text_chunks(stream, TEXT_FALLBACK_ENCODING, errors='replace', max_chars=max_chars)
+
+
+def clean_pdf_page_text(page_text):
+    """Collapse runs of whitespace and drop empty lines from extracted page text"""
+    if not page_text:
+        return ''
+
+    cleaned_lines = []
+    for line in page_text.split('\n'):
+        cleaned_line = WHITESPACE_PATTERN.sub(' ', line).strip()
+        if cleaned_line:
+            cleaned_lines.append(cleaned_line)
+    return '\n'.join(cleaned_lines)
+
+
+def iter_pdf_pages(file, page_ranges=None):
+    """
+    Yield (page_number, total_pages, cleaned_text) for each selected page.
+    Pages are parsed lazily, so breaking out of the loop skips the rest.
+    """
+    reader = PyPDF2.PdfReader(file)
+    total_pages = len(reader.pages)
+
+    for index in resolve_page_numbers(page_ranges, total_pages):
+        page_text = reader.pages[index].extract_text()
+        yield index + 1, total_pages, clean_pdf_page_text(page_text)
+
+
+def join_pdf_pages(pages, max_chars=None):
+    """
+    Join (page_number, total_pages, text) tuples into the document text with
+    page markers, stopping once max_chars of page text has been collected.
+    Returns (text, truncated).
+    """
+    text = []
+    collected = 0
+    truncated = False
+
+    for page_number, total_pages, page_text in pages:
+        if not page_text:
+            continue
+
+        if max_chars is not None and collected + len(page_text) > max_chars:
+            page_text = page_text[:max_chars - collected]
+            truncated = True
+            if not page_text:
+                # The budget ran out exactly at the page boundary
+                break
+
+        # Add page number for longer documents
+        if total_pages > 1:
+            text.append(f"--- Page {page_number} ---\n")
+        text.append(page_text)
+        collected += len(page_text)
+
+        if truncated:
+            break
+        # Add extra newline between pages
+        if page_number < total_pages:
+            text.append("\n")
+
+    return "\n".join(text).rstrip('\n'), truncated
+
+
+def split_pdf_text(text, total_pages):
+    """The (page_number, total_pages, text) tuples join_pdf_pages built text from"""
+    markers = list(PDF_PAGE_MARKER_PATTERN.finditer(text))
+    if not markers:
+        # Single-page documents carry no marker
+        return [(1, total_pages, text)] if text else []
+
+    pages = []
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        pages.append((int(marker.group(1)), total_pages, text[marker.end():end].strip('\n')))
+    return pages
+
+
+def select_pdf_pages(text, total_pages, page_ranges=None, max_chars=None):
+    """
+    Apply a page selection and character budget to a whole extracted PDF,
+    as if only those pages had been extracted. Returns (text, truncated).
+    """
+    pages = split_pdf_text(text, total_pages)
+    if page_ranges:
+        selected = {index + 1 for index in resolve_page_numbers(page_ranges, total_pages)}
+        pages = [page for page in pages if page[0] in selected]
+    return join_pdf_pages(pages, max_chars)
+
+
+def extract_pdf_text(file, page_ranges=None, max_chars=None):
+    """Extract the selected pages of a PDF, stopping early at max_chars"""
+    return join_pdf_pages(iter_pdf_pages(file, page_ranges), max_chars)
+
+
+class ExtractionError(Exception):
+    """Raised when a document cannot be extracted by the worker pool"""
+
+
+class ExtractionTimeout(ExtractionError):
+    """Raised when extraction exceeds its wall-clock limit"""
+
+
+def init_extraction_worker(memory_limit_bytes, task_slots=None):
+    """
+    Pool initializer: claim a slot for reporting task start times, and cap
+    the worker's address space so a huge document fails alone
+    """
+    global _worker_slot, _task_slots
+    if task_slots is not None:
+        _task_slots = task_slots
+        next_slot = task_slots[2]
+        with next_slot.get_lock():
+            _worker_slot = next_slot.value
+            next_slot.value += 1
+
+    if not memory_limit_bytes or resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        memory_limit_bytes = min(memory_limit_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, hard))
+
+
+def report_task_start(task_id):
+    """In a pool worker: record that task_id started now (0 marks the worker idle)"""
+    if _task_slots is None or _worker_slot is None:
+        return
+    task_ids, started_at, _ = _task_slots
+    started_at[_worker_slot] = time.time()
+    task_ids[_worker_slot] = task_id
+
+
+def task_started_at(task_id):
+    """When a pool worker started task_id, or None if it is still queued (or already done)"""
+    slots = _task_slots
+    if slots is None:
+        return None
+    task_ids, started_at, _ = slots
+    for slot in range(len(task_ids)):
+        if task_ids[slot] == task_id:
+            return started_at[slot]
+    return None
+
+
+def _raise_task_timeout(signum, frame):
+    raise ExtractionTimeout("Extraction took too long")
+
+
+def run_with_time_limit(timeout, task_id, func, *args):
+    """
+    Pool task wrapper: report the start of task_id, then run func under a
+    SIGALRM timer. PyPDF2 and the DOCX reader are pure Python, so the alarm
+    interrupts them and the worker stays usable.
+    """
+    report_task_start(task_id)
+    try:
+        if not timeout or not hasattr(signal, 'setitimer'):
+            return func(*args)
+
+        previous_handler = signal.signal(signal.SIGALRM, _raise_task_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            return func(*args)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+    finally:
+        report_task_start(0)
+
+
+def get_extraction_pool():
+    """
+    Return the process pool shared by all requests, creating it on first use.
+    Workers are spawned rather than forked so they never inherit the app's
+    MongoDB client or other thread state, and each one runs under a memory cap.
+    """
+    global _extraction_pool, _task_slots
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            context = multiprocessing.get_context('spawn')
+            _task_slots = (
+                context.RawArray('q', EXTRACTION_WORKERS),
+                context.RawArray('d', EXTRACTION_WORKERS),
+                context.Value('i', 0)
+            )
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=EXTRACTION_WORKERS,
+                mp_context=context,
+                initializer=init_extraction_worker,
+                initargs=(EXTRACTION_WORKER_MEMORY_MB * 1024 * 1024, _task_slots)
+            )
+        return _extraction_pool
+
+
+def reset_extraction_pool(pool=None, terminate=False):
+    """
+    Drop the shared pool; the next extraction starts a fresh one. With
+    terminate, worker processes are killed first (used for stuck workers).
+    Given the pool a failed task ran on, nothing happens if that pool has
+    already been replaced, so concurrent requests that saw the same failure
+    do not shut down the healthy pool one of them just started.
+    """
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None or (pool is not None and pool is not _extraction_pool):
+            return
+        if terminate:
+            for process in list((_extraction_pool._processes or {}).values()):
+                process.kill()
+        _extraction_pool.shutdown(wait=False, cancel_futures=True)
+        _extraction_pool = None
+
+
+def submit_extraction(func, *args):
+    """Queue func on the shared pool under the per-task time limit"""
+    task_id = next(_task_ids)
+    pool = get_extraction_pool()
+    try:
+        future = pool.submit(run_with_time_limit, EXTRACTION_TASK_TIMEOUT, task_id, func, *args)
+    except BrokenProcessPool:
+        # A worker died while the pool was idle; nobody was waiting to reset it
+        reset_extraction_pool(pool)
+        pool = get_extraction_pool()
+        future = pool.submit(run_with_time_limit, EXTRACTION_TASK_TIMEOUT, task_id, func, *args)
+    future.task_id = task_id
+    future.pool = pool
+    return future
+
+
+def wait_for_extraction(future):
+    """
+    Wait for a pool task. The in-worker alarm enforces the time limit; the
+    pool is only torn down if a worker has run this task well past it (stuck
+    in C code). Time spent queued behind other uploads never counts.
+    """
+    try:
+        while True:
+            try:
+                return future.result(timeout=EXTRACTION_TIMEOUT_GRACE)
+            except FuturesTimeoutError:
+                started = task_started_at(future.task_id)
+                if started and time.time() - started > EXTRACTION_TASK_TIMEOUT + EXTRACTION_TIMEOUT_GRACE:
+                    reset_extraction_pool(future.pool, terminate=True)
+                    raise ExtractionTimeout("Extraction worker stopped responding")
+    except MemoryError:
+        raise ExtractionError("Document needs more memory than an extraction worker is allowed")
+    except BrokenProcessPool:
+        reset_extraction_pool(future.pool)
+        raise ExtractionError("Extraction worker crashed, the document may be too large or malformed")
+
+
+def extract_pdf_page_chunk(path, page_ranges, chunk_index, chunk_size):
+    """
+    Pool task: open the PDF at path and extract one chunk of the selected pages.
+    A page that fails to parse is returned empty with its error, so one bad
+    page does not lose the rest of the document.
+    Returns (total_pages, selected_page_count, [(page_number, text, error)]).
+    """
+    # Parse from a read-only memory map: PyPDF2 would otherwise copy the whole
+    # file into memory, and workers on the same file share the mapped pages
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        reader = PyPDF2.PdfReader(mapped)
+        total_pages = len(reader.pages)
+        indexes = list(resolve_page_numbers(page_ranges, total_pages))
+
+        pages = []
+        for index in indexes[chunk_index * chunk_size:(chunk_index + 1) * chunk_size]:
+            try:
+                pages.append((index + 1, clean_pdf_page_text(reader.pages[index].extract_text()), None))
+            except ExtractionTimeout:
+                raise
+            except Exception as e:
+                pages.append((index + 1, '', f"{type(e).__name__}: {e}"))
+
+    return total_pages, len(indexes), pages
+
+
+def iter_pdf_pages_isolated(path, page_ranges=None, page_errors=None):
+    """
+    Like iter_pdf_pages, but every page is parsed on the sandboxed pool.
+
+    The first chunk also reports the page count, so the web worker never
+    parses the PDF itself. Pages are yielded in document order, only a window
+    of chunks is in flight at once, and closing the generator cancels
+    whatever has not started. Per-page failures are appended to page_errors.
+    """
+    total_pages, selected, pages = wait_for_extraction(
+        submit_extraction(extract_pdf_page_chunk, path, page_ranges, 0, PAGES_PER_TASK)
+    )
+    chunk_count = -(-selected // PAGES_PER_TASK)
+    pending = []
+    next_chunk = 1
+
+    try:
+        while True:
+            for page_number, page_text, error in pages:
+                if error and page_errors is not None:
+                    page_errors.append((page_number, error))
+                yield page_number, total_pages, page_text
+
+            # Keep each worker busy without queueing the whole document
+            while next_chunk < chunk_count and len(pending) < EXTRACTION_WORKERS * 2:
+                pending.append(submit_extraction(extract_pdf_page_chunk, path, page_ranges, next_chunk, PAGES_PER_TASK))
+                next_chunk += 1
+
+            if not pending:
+                break
+            _, _, pages = wait_for_extraction(pending.pop(0))
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def extract_pdf_file(path, page_ranges=None, max_chars=None, page_errors=None):
+    """Extract a PDF stored at path on the sandboxed pool"""
+    return join_pdf_pages(iter_pdf_pages_isolated(path, page_ranges, page_errors), max_chars)
+
+
+def extract_pdf_document(path, page_ranges=None, max_chars=None, page_errors=None):
+    """
+    Like extract_pdf_file, but also reports the document's page count, which
+    select_pdf_pages needs to narrow a cached whole-document extraction.
+    Returns (text, truncated, total_pages).
+    """
+    total_pages = 0
+
+    def pages():
+        nonlocal total_pages
+        for page in iter_pdf_pages_isolated(path, page_ranges, page_errors):
+            total_pages = page[1]
+            yield page
+
+    text, truncated = join_pdf_pages(pages(), max_chars)
+    return text, truncated, total_pages
+
+
+def iter_docx_blocks(path):
+    """
+    Stream word/document.xml and yield paragraph text and " | "-joined table
+    rows in document order. Elements are cleared once read, so memory stays
+    flat however long the document is.
+    """
+    with zipfile.ZipFile(path) as archive, archive.open('word/document.xml') as document:
+        body = None
+        table_depth = 0
+        paragraphs = []   # Stack of text parts; text boxes nest paragraphs
+        row_cells = []
+        cell_paragraphs = []
+
+        for event, elem in ElementTree.iterparse(document, events=('start', 'end')):
+            tag = elem.tag
+            if event == 'start':
+                if tag == DOCX_PARAGRAPH:
+                    paragraphs.append([])
+                elif tag == DOCX_TABLE:
+                    table_depth += 1
+                elif tag == DOCX_ROW and table_depth == 1:
+                    row_cells = []
+                elif tag == DOCX_CELL and table_depth == 1:
+                    cell_paragraphs = []
+                elif tag == DOCX_BODY:
+                    body = elem
+                continue
+
+            if tag == DOCX_TEXT:
+                if paragraphs:
+                    paragraphs[-1].append(elem.text or '')
+            elif tag == DOCX_TAB:
+                if paragraphs:
+                    paragraphs[-1].append('\t')
+            elif tag in DOCX_BREAKS:
+                if paragraphs:
+                    paragraphs[-1].append('\n')
+            elif tag == DOCX_PARAGRAPH:
+                text = ''.join(paragraphs.pop())
+                if table_depth:
+                    cell_paragraphs.append(text)
+                elif paragraphs:
+                    # A text box paragraph inside another paragraph
+                    paragraphs[-1].append(text)
+                elif text.strip():
+                    yield text
+            elif tag == DOCX_CELL and table_depth == 1:
+                cell_text = '\n'.join(cell_paragraphs).strip()
+                if cell_text:
+                    row_cells.append(cell_text)
+            elif tag == DOCX_ROW and table_depth == 1:
+                if row_cells:
+                    yield " | ".join(row_cells)
+            elif tag == DOCX_TABLE:
+                table_depth -= 1
+
+            # Drop finished top-level blocks so the tree never grows
+            if body is not None and table_depth == 0 and not paragraphs and tag in (DOCX_PARAGRAPH, DOCX_TABLE):
+                body.clear()
+
+
+def truncate_docx_text(text, max_chars=None):
+    """
+    Cut joined DOCX text to max_chars at the last block boundary that fits;
+    a single block longer than the budget is cut mid-block.
+    Returns (text, truncated).
+    """
+    if max_chars is None or len(text) <= max_chars:
+        return text, False
+    boundary = text.rfind("\n\n", 0, max_chars + 2)
+    return (text[:boundary] if boundary > 0 else text[:max_chars]), True
+
+
+def join_docx_blocks(blocks, max_chars=None):
+    """Join blocks as extract_docx_blocks does, stopping once max_chars is passed"""
+    text = []
+    length = -2
+    for block in blocks:
+        text.append(block)
+        length += len(block) + 2
+        if max_chars is not None and length > max_chars:
+            break
+    return truncate_docx_text("\n\n".join(text), max_chars)
+
+
+def extract_docx_blocks(path, max_chars=None):
+    """
+    Pool task: the document's paragraphs and table rows, in order, stopping
+    at max_chars. Returns (text, truncated).
+    """
+    try:
+        return join_docx_blocks(iter_docx_blocks(path), max_chars)
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise ExtractionError(f"Not a readable DOCX file: {e}")
+
+
+def extract_docx_file(path, max_chars=None):
+    """Extract a DOCX stored at path on the sandboxed pool. Returns (text, truncated)."""
+    return wait_for_extraction(submit_extraction(extract_docx_blocks, path, max_chars))
@@ -0,0 +1,244 @@
+"""
+Font Style Detection for Mr. Wlah
+
+Helpers for detecting the font styling of pasted HTML and re-applying it to
+transformed text. Kept separate from app.py so the scanner can be used (and
+benchmarked) without booting the Flask app.
+"""
+
+import html
+import re
+
+# Opening tags: name plus the raw attribute text
+TAG_PATTERN = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)([^>]*)>')
+
+# The only attributes that carry font information
+STYLE_ATTRIBUTE_PATTERN = re.compile(
+    r'''(?<![\w-])(style|face)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE
+)
+
+# Matches "property: value" pairs inside style attributes. <style> blocks are
+# not parsed: selectors such as a:hover would read as declarations.
+CSS_DECLARATION_PATTERN = re.compile(r'([a-z-]+)\s*:\s*([^;]+)', re.IGNORECASE)
+
+BOLD_TAGS = {'b', 'strong'}
+ITALIC_TAGS = {'i', 'em'}
+UNDERLINE_TAGS = {'u', 'ins'}
+BOLD_WEIGHTS = {'bold', 'bolder', '600', '700', '800', '900'}
+
+
+class FontStyleScanner:
+    """
+    Single-pass scanner that collects tags, inline CSS properties and
+    <font face> values together from one sweep over the opening tags.
+    """
+
+    def __init__(self):
+        self.tags = {}  # Insertion-ordered set of tag names
+        self.css = {}   # First value seen for each CSS property
+        self.font_face = None
+        self.bold = False
+        self.italic = False
+        self.underline = False
+
+    def scan(self, text):
+        # Pasted HTML repeats the same tag and attributes on every element,
+        # so only the distinct (tag, attributes) pairs are inspected
+        for name, attributes in dict.fromkeys(TAG_PATTERN.findall(text)):
+            tag = name.lower()
+            self.tags[tag] = None
+
+            if tag in BOLD_TAGS:
+                self.bold = True
+            elif tag in ITALIC_TAGS:
+                self.italic = True
+            elif tag in UNDERLINE_TAGS:
+                self.underline = True
+
+            # Substring checks are far cheaper than running the attribute
+            # regex over every tag; most tags carry neither attribute
+            if '=' in attributes:
+                lowered = attributes.lower()
+                if 'style' in lowered or 'face' in lowered:
+                    self.collect_attributes(tag, attributes)
+
+    def collect_attributes(self, tag, attributes):
+        for attr in STYLE_ATTRIBUTE_PATTERN.finditer(attributes):
+            name = attr.group(1).lower()
+            value = html.unescape(attr.group(2) or attr.group(3) or attr.group(4) or '')
+            if name == 'style':
+                self.collect_css(value)
+            elif tag == 'font' and self.font_face is None and value.strip():
+                self.font_face = value.strip()
+
+    def collect_css(self, declarations):
+        """Record inline CSS declarations, keeping the first value of each property"""
+        for match in CSS_DECLARATION_PATTERN.finditer(declarations):
+            prop = match.group(1).lower()
+            value = match.group(2).strip()
+            if not value:
+                continue
+
+            if prop == 'font-weight' and value.lower() in BOLD_WEIGHTS:
+                self.bold = True
+            elif prop == 'font-style' and value.lower() == 'italic':
+                self.italic = True
+            elif prop == 'text-decoration' and 'underline' in value.lower():
+                self.underline = True
+
+            self.css.setdefault(prop, value)
+
+
+def detect_font_style(text):
+    """Detect font style markers in HTML or common text formatting"""
+    font_info = {
+        'font_family': None,
+        'font_size': None,
+        'font_style': None,
+        'font_weight': None,
+        'text_decoration': None,
+        'color': None,
+        'html_tags': []
+    }
+
+    # Plain text has nothing to scan
+    if not text or '<' not in text:
+        return font_info
+
+    scanner = FontStyleScanner()
+    scanner.scan(text)
+
+    font_info['html_tags'] = list(scanner.tags)
+
+    # A <font face> wins over inline CSS, matching the order browsers apply
+    font_info['font_family'] = scanner.font_face or scanner.css.get('font-family')
+    font_info['font_size'] = scanner.css.get('font-size')
+    font_info['color'] = scanner.css.get('color')
+
+    if scanner.bold:
+        font_info['font_weight'] = 'bold'
+    if scanner.italic:
+        font_info['font_style'] = 'italic'
+    if scanner.underline:
+        font_info['text_decoration'] = 'underline'
+
+    return font_info
+
+
+def apply_font_style(text, font_info):
+    """Apply detected font style to the output text"""
+    
+    # If no style detected, return text as is
+    if not any(font_info.values()):
+        return text
+    
+    # If HTML tags detected, try to maintain structure
+    if font_info['html_tags'] and not ('script' in font_info['html_tags'] or 'style' in font_info['html_tags']):
+        # Apply basic styling
+        styled_text = text
+        
+        # Apply font family if detected
+        if font_info['font_family']:
+            styled_text = f'<span style="font-family: {font_info["font_family"]}">{styled_text}</span>'
+        
+        # Apply font size if detected
+        if font_info['font_size']:
+            styled_text = f'<span style="font-size: {font_info["font_size"]}">{styled_text}</span>'
+        
+        # Apply bold if detected
+        if font_info['font_weight'] == 'bold':
+            styled_text = f'<b>{styled_text}</b>'
+        
+        # Apply italic if detected
+        if font_info['font_style'] == 'italic':
+            styled_text = f'<i>{styled_text}</i>'
+        
+        # Apply underline if detected
+        if font_info['text_decoration'] == 'underline':
+            styled_text = f'<u>{styled_text}</u>'
+        
+        # Apply color if detected
+        if font_info['color']:
+            styled_text = f'<span style="color: {font_info["color"]}">{styled_text}</span>'
+        
+        return styled_text
+    
+    return text
+
+
+# Markup that never carries transformable text: tags, comments, and the
+# bodies of <script>/<style> blocks
+MARKUP_PATTERN = re.compile(
+    r'<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>', re.IGNORECASE | re.DOTALL
+)
+
+# Markers that label each text run when it is sent to the model
+RUN_MARKER_PATTERN = re.compile(r'⟦(\d+)⟧')
+
+
+def split_styled_runs(text):
+    """
+    Split styled HTML into a formatting skeleton and the text runs inside it.
+
+    The skeleton is a list of raw markup strings and integer run indexes;
+    whitespace between tags stays in the skeleton so only real text is sent
+    to the model.
+    """
+    skeleton = []
+    runs = []
+
+    def add_chunk(chunk):
+        if not chunk.strip():
+            if chunk:
+                skeleton.append(chunk)
+            return
+        body = chunk.strip()
+        leading = chunk[:len(chunk) - len(chunk.lstrip())]
+        trailing = chunk[len(chunk.rstrip()):]
+        if leading:
+            skeleton.append(leading)
+        skeleton.append(len(runs))
+        runs.append(html.unescape(body))
+        if trailing:
+            skeleton.append(trailing)
+
+    position = 0
+    for match in MARKUP_PATTERN.finditer(text):
+        add_chunk(text[position:match.start()])
+        skeleton.append(match.group(0))
+        position = match.end()
+    add_chunk(text[position:])
+
+    return skeleton, runs
+
+
+def format_runs_for_prompt(runs):
+    """Label each text run with a ⟦n⟧ marker, one run per line"""
+    return '\n'.join(f'⟦{index}⟧ {run}' for index, run in enumerate(runs))
+
+
+def parse_transformed_runs(response_text, run_count):
+    """
+    Recover the transformed runs from a marker-labelled model response.
+    Returns None if any marker is missing or repeated.
+    """
+    parts = RUN_MARKER_PATTERN.split(response_text)
+    runs = {}
+    # split() yields [preamble, index, text, index, text, ...]
+    for i in range(1, len(parts) - 1, 2):
+        index = int(parts[i])
+        if index in runs or index >= run_count:
+            return None
+        runs[index] = parts[i + 1].strip()
+
+    if len(runs) != run_count:
+        return None
+    return [runs[index] for index in range(run_count)]
+
+
+def rebuild_styled_text(skeleton, runs):
+    """Reinsert transformed runs into the original formatting skeleton"""
+    return ''.join(
+        html.escape(runs[part], quote=False) if isinstance(part, int) else part
+        for part in skeleton
+    )
@@ -12,9 +12,11 @@ import datetime
 import argparse
 import re
 from dotenv import load_dotenv
-from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT
+from pymongo import MongoClient
 from pymongo.server_api import ServerApi
 
+from db_indexes import INDEX_SPECS, ensure_collection_indexes
+
 # Load environment variables
 load_dotenv()
 
@@ -78,37 +80,11 @@ def initialize_database(verbose=False, force=False):
         if verbose:
             print(f"Creating collections in database '{mongo_db}'")
         
-        # Create users collection
-        users = db.users
-        users.create_index([("auth0Id", ASCENDING)], unique=True)
-        users.create_index([("email", ASCENDING)])
-        users.create_index([("name", TEXT)])
-        users.create_index([("lastLogin", DESCENDING)])
-        if verbose:
-            print("Created 'users' collection with indexes")
-        
-        # Create transformations collection
-        transformations = db.transformations
-        transformations.create_index([("userId", ASCENDING)])
-        transformations.create_index([("createdAt", DESCENDING)])
-        transformations.create_index([("tone", ASCENDING)])
-        if verbose:
-            print("Created 'transformations' collection with indexes")
-        
-        # Create API usage collection
-        api_usage = db.apiUsage
-        api_usage.create_index([("userId", ASCENDING)])
-        api_usage.create_index([("date", DESCENDING)])
-        if verbose:
-            print("Created 'apiUsage' collection with indexes")
-        
-        # Create logs collection
-        logs = db.logs
-        logs.create_index([("timestamp", DESCENDING)])
-        logs.create_index([("level", ASCENDING)])
-        logs.create_index([("userId", ASCENDING)])
-        if verbose:
-            print("Created 'logs' collection with indexes")
+        # Create collections with the indexes declared in db_indexes.py
+        for collection_name in INDEX_SPECS:
+            ensure_collection_indexes(db, collection_name)
+            if verbose:
+                print(f"Created '{collection_name}' collection with indexes")
         
         # Insert initialization record
         db.system.insert_one({
@@ -9,9 +9,11 @@ MongoDB database, including users, logs, transformations, and API usage tracking
 import os
 import sys
 import datetime
-from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT
+from pymongo import MongoClient
 from pymongo.server_api import ServerApi
 
+from db_indexes import ensure_collection_indexes
+
 def initialize_benchai_database():
     """Initialize collections in the BenchAI database for Mr. Wlah."""
     # Set the MongoDB connection URI for BenchAI
@@ -50,11 +52,7 @@ def initialize_benchai_database():
         # Create users collection if it doesn't exist
         if 'users' not in existing_collections:
             print("\nCreating 'users' collection...")
-            users = db.users
-            users.create_index([("auth0Id", ASCENDING)], unique=True)
-            users.create_index([("email", ASCENDING)])
-            users.create_index([("name", TEXT)])
-            users.create_index([("lastLogin", DESCENDING)])
+            ensure_collection_indexes(db, 'users')
             print("✅ Created 'users' collection with indexes")
         else:
             print("\n'users' collection already exists")
@@ -63,10 +61,7 @@ def initialize_benchai_database():
         if 'logs' not in existing_collections:
             print("Creating 'logs' collection...")
             logs = db.logs
-            logs.create_index([("timestamp", DESCENDING)])
-            logs.create_index([("level", ASCENDING)])
-            logs.create_index([("userId", ASCENDING)])
-            logs.create_index([("source", ASCENDING)])
+            ensure_collection_indexes(db, 'logs')
             print("✅ Created 'logs' collection with indexes")
             
             # Add initial system log entry
@@ -83,10 +78,7 @@ def initialize_benchai_database():
         # Create transformations collection if it doesn't exist
         if 'transformations' not in existing_collections:
             print("Creating 'transformations' collection...")
-            transformations = db.transformations
-            transformations.create_index([("userId", ASCENDING)])
-            transformations.create_index([("createdAt", DESCENDING)])
-            transformations.create_index([("tone", ASCENDING)])
+            ensure_collection_indexes(db, 'transformations')
             print("✅ Created 'transformations' collection with indexes")
         else:
             print("'transformations' collection already exists")
@@ -94,13 +86,19 @@ def initialize_benchai_database():
         # Create apiUsage collection if it doesn't exist
         if 'apiUsage' not in existing_collections:
             print("Creating 'apiUsage' collection...")
-            api_usage = db.apiUsage
-            api_usage.create_index([("userId", ASCENDING)])
-            api_usage.create_index([("date", DESCENDING)])
+            ensure_collection_indexes(db, 'apiUsage')
             print("✅ Created 'apiUsage' collection with indexes")
         else:
             print("'apiUsage' collection already exists")
         
+        # Create documents collection if it doesn't exist
+        if 'documents' not in existing_collections:
+            print("Creating 'documents' collection...")
+            ensure_collection_indexes(db, 'documents')
+            print("✅ Created 'documents' collection with TTL index")
+        else:
+            print("'documents' collection already exists")
+        
         # Insert system information
         if 'system' not in existing_collections:
             print("Creating 'system' collection...")
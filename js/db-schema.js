@@ -11,6 +11,7 @@ and used with Mongoose or a similar ODM.
 // User Schema
 const UserSchema = {
     _id: ObjectId,
+    user_id: String,              // Auth0 user ID, used for all lookups
     auth0Id: String,              // Auth0 user ID
     email: String,                // User's email from Auth0
     name: String,                 // User's name from Auth0
@@ -26,9 +27,11 @@ const UserSchema = {
 // Transformation History Schema
 const TransformationSchema = {
     _id: ObjectId,
-    userId: ObjectId,             // Reference to user who created this transformation
-    originalText: String,         // The original AI-generated text
-    transformedText: String,      // The humanized text output
+    user_id: String,              // Auth0 ID of the user who created this transformation
+    originalText: String,         // The original AI-generated text (zlib BinData when large)
+    transformedText: String,      // The humanized text output (zlib BinData when large)
+    preview: String,              // Start of transformedText, shown in history listings
+    previewTruncated: Boolean,    // Whether transformedText is longer than preview
     tone: String,                 // The tone used for transformation
     createdAt: Date,              // When the transformation was created
     metadata: {                   // Additional metadata
@@ -37,31 +40,42 @@ const TransformationSchema = {
     }
 };
 
-// API Usage Stats Schema
+// API Usage Stats Schema (one bucket per user per UTC day, updated with $inc)
 const ApiUsageSchema = {
     _id: ObjectId,
-    userId: ObjectId,             // Reference to user
-    date: Date,                   // Date of API usage
-    callCount: Number,            // Number of API calls made
-    characterCount: Number,       // Total characters processed
+    user_id: String,              // Auth0 ID of the user
+    date: Date,                   // Start of the UTC day
+    callCount: Number,            // Number of Gemini calls made
+    characterCount: Number,       // Total characters sent to Gemini
     successCount: Number,         // Number of successful transformations
-    errorCount: Number            // Number of failed transformations
+    errorCount: Number,           // Number of failed transformations
+    promptTokens: Number,         // Token counts from Gemini's usage_metadata
+    outputTokens: Number,
+    thoughtsTokens: Number,
+    cachedTokens: Number,
+    totalTokens: Number,
+    latencyMsTotal: Number,       // Sum of call latencies; divide by callCount for the average
+    latencyMsMax: Number,         // Slowest call of the day
+    lastCallAt: Date,
+    createdAt: Date
 };
 
 // Example MongoDB Indexes
 /*
+db.users.createIndex({ "user_id": 1 });
 db.users.createIndex({ "auth0Id": 1 }, { unique: true });
 db.users.createIndex({ "email": 1 });
-db.transformations.createIndex({ "userId": 1 });
+db.users.createIndex({ "lastActive": -1, "_id": -1 });
+db.transformations.createIndex({ "user_id": 1, "createdAt": -1 });
 db.transformations.createIndex({ "createdAt": -1 });
-db.apiUsage.createIndex({ "userId": 1, "date": 1 });
+db.apiUsage.createIndex({ "user_id": 1, "date": -1 }, { unique: true });
 */
 
 // Example MongoDB Queries
 
 // Get all transformations for a user
 /*
-db.transformations.find({ userId: ObjectId("user_id_here") })
+db.transformations.find({ user_id: "user_id_here" })
                   .sort({ createdAt: -1 })
                   .limit(10);
 */
@@ -70,13 +84,14 @@ db.transformations.find({ userId: ObjectId("user_id_here") })
 /*
 db.apiUsage.aggregate([
     { $match: { 
-        userId: ObjectId("user_id_here"),
+        user_id: "user_id_here",
         date: { $gte: new Date(Date.now() - 30*24*60*60*1000) }
     }},
     { $group: {
         _id: null,
         totalCalls: { $sum: "$callCount" },
         totalCharacters: { $sum: "$characterCount" },
+        totalTokens: { $sum: "$totalTokens" },
         avgSuccessRate: { $avg: { $divide: ["$successCount", { $add: ["$successCount", "$errorCount"] }] } }
     }}
 ]);
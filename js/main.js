@@ -24,6 +24,10 @@ const downloadProcessingLabel = document.querySelector('.download-processing-lab
 // Gemini API configuration (loaded from config)
 let API_KEY, API_URL;
 
+// Server-side handle for the last uploaded document. Transforms send its ID
+// instead of the text; it is dropped as soon as the user edits the input.
+let uploadedDocument = null;
+
 // Initialize configuration
 function initConfig() {
     // In a production app, these would come from MrWlahConfig
@@ -52,6 +56,7 @@ function setupClearButtons() {
     if (clearInputBtn) {
         clearInputBtn.addEventListener('click', () => {
             if (inputText) {
+                forgetUploadedDocument();
                 inputText.value = '';
                 inputText.focus();
             }
@@ -110,6 +115,8 @@ fileInput.addEventListener('change', async (e) => {
     const file = e.target.files[0];
     if (!file) return;
     
+    forgetUploadedDocument();
+    
     fileName.textContent = file.name;
     // Show the remove file button
     removeFileBtn.style.display = 'inline-block';
@@ -310,6 +317,22 @@ async function processFileOnServer(file) {
             throw new Error(data.error);
         }
         
+        if (data.documentId) {
+            // The text stays on the server; show a preview and keep the handle
+            uploadedDocument = {
+                id: data.documentId,
+                wordCount: data.wordCount,
+                complete: data.complete
+            };
+            inputText.value = data.preview || '';
+            if (!data.complete) {
+                const remaining = data.characterCount - data.preview.length;
+                inputText.value += `\n\n[... ${remaining.toLocaleString()} more characters. Click to load the full text for editing.]`;
+                inputText.readOnly = true;
+            }
+            return data.preview;
+        }
+        
         // Update input text with extracted content
         inputText.value = data.originalText || '';
         
@@ -321,6 +344,43 @@ async function processFileOnServer(file) {
     }
 }
 
+// Drop the server-side handle once the input no longer matches it
+function forgetUploadedDocument() {
+    uploadedDocument = null;
+    inputText.readOnly = false;
+}
+
+// Load the full text of a previewed document so it can be edited
+async function loadFullDocument() {
+    if (!uploadedDocument || uploadedDocument.complete || uploadedDocument.loading) return;
+    
+    uploadedDocument.loading = true;
+    try {
+        const response = await fetch(`/api/documents/${encodeURIComponent(uploadedDocument.id)}`);
+        const data = await response.json();
+        if (!response.ok || data.error) {
+            throw new Error(data.error || 'Could not load document');
+        }
+        inputText.value = data.text;
+        inputText.readOnly = false;
+        uploadedDocument.complete = true;
+    } catch (error) {
+        console.error('Error loading document:', error);
+        alert('The uploaded document has expired. Please upload it again.');
+        forgetUploadedDocument();
+        inputText.value = '';
+    } finally {
+        if (uploadedDocument) uploadedDocument.loading = false;
+    }
+}
+
+inputText.addEventListener('click', loadFullDocument);
+
+inputText.addEventListener('input', () => {
+    // Edited text is no longer the uploaded document
+    if (uploadedDocument) forgetUploadedDocument();
+});
+
 // Remove File Handling
 removeFileBtn.addEventListener('click', () => {
     // Clear the file input
@@ -333,6 +393,7 @@ removeFileBtn.addEventListener('click', () => {
     docProcessingContainer.classList.remove('active');
     // Clear the input text area if it contains file content
     if (inputText.value && confirm('Do you want to clear the text that was loaded from the file?')) {
+        forgetUploadedDocument();
         inputText.value = '';
         inputText.focus();
     }
@@ -351,8 +412,10 @@ transformBtn.addEventListener('click', async () => {
         return;
     }
 
-    // Calculate original word count
-    const originalWordCount = text.split(/\s+/).filter(word => word.length > 0).length;
+    // Calculate original word count (a previewed upload only shows part of its text)
+    const originalWordCount = uploadedDocument
+        ? uploadedDocument.wordCount
+        : text.split(/\s+/).filter(word => word.length > 0).length;
 
     // Show loading state
     transformBtn.disabled = true;
@@ -362,7 +425,9 @@ transformBtn.addEventListener('click', async () => {
     try {
         // If using an experimental mode, send a neutral tone to backend (ignored when mode set)
         const effectiveTone = mode ? 'casual' : tone;
-        const transformedText = await transformTextWithGemini(text, effectiveTone, preserveFont, originalWordCount, mode);
+        const transformedText = await transformTextWithGemini(
+            text, effectiveTone, preserveFont, originalWordCount, mode, uploadedDocument?.id
+        );
 
         // If transformed text has HTML content, use innerHTML, otherwise use textContent
         if (/<[a-z][\s\S]*>/i.test(transformedText)) {
@@ -389,7 +454,7 @@ transformBtn.addEventListener('click', async () => {
 });
 
 // Gemini API Call
-async function transformTextWithGemini(text, tone, preserveFont = true, targetWordCount = null, mode = null) {
+async function transformTextWithGemini(text, tone, preserveFont = true, targetWordCount = null, mode = null, documentId = null) {
     // In a real implementation with a backend server, we would call the API endpoint
     try {
         const response = await fetch('/api/transform', {
@@ -397,8 +462,9 @@ async function transformTextWithGemini(text, tone, preserveFont = true, targetWo
             headers: {
                 'Content-Type': 'application/json',
             },
+            // An uploaded document is referenced by ID rather than sent again
             body: JSON.stringify({
-                text,
+                ...(documentId ? { documentId } : { text }),
                 tone,
                 preserveFont,
                 targetWordCount,
@@ -406,6 +472,19 @@ async function transformTextWithGemini(text, tone, preserveFont = true, targetWo
             })
         });
         
+        if (response.status === 404 && documentId) {
+            // The stored upload expired; resend the text if we have all of it
+            const data = await response.json();
+            const fullTextShown = uploadedDocument?.complete;
+            forgetUploadedDocument();
+            if (data.documentExpired && fullTextShown) {
+                return transformTextWithGemini(text, tone, preserveFont, targetWordCount, mode);
+            }
+            const expired = new Error('Uploaded document expired');
+            expired.documentExpired = true;
+            throw expired;
+        }
+        
         if (!response.ok) {
             throw new Error('API request failed');
         }
@@ -425,6 +504,12 @@ async function transformTextWithGemini(text, tone, preserveFont = true, targetWo
     } catch (error) {
         console.error('API error:', error);
         
+        // Simulating from a partial preview would be misleading
+        if (error.documentExpired) {
+            alert('The uploaded document has expired. Please upload it again.');
+            throw error;
+        }
+        
         // Fallback to simulation if server is not available
         console.log('Falling back to simulated transformation');
         const simulated = simulateTransformation(text, tone);
@@ -837,20 +922,36 @@ function handleDownloadError(errorMessage) {
     }, 3000);
 }
 
+// Last downloaded document, reused when the server answers 304 for the same text
+let lastRenderedDocument = null;
+
 // Generate document on server
 async function generateDocumentOnServer(text, format) {
     try {
+        const headers = {
+            'Content-Type': 'application/json',
+        };
+        if (lastRenderedDocument) {
+            headers['If-None-Match'] = lastRenderedDocument.etag;
+        }
+        
         const response = await fetch('/api/document/generate', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers,
             body: JSON.stringify({
                 text,
                 fileType: format
             })
         });
         
+        if (response.status === 304 && lastRenderedDocument) {
+            return {
+                content: lastRenderedDocument.blob,
+                type: getContentType(format),
+                isBlob: true
+            };
+        }
+        
         if (!response.ok) {
             throw new Error(`Server failed to generate ${format} document`);
         }
@@ -859,6 +960,10 @@ async function generateDocumentOnServer(text, format) {
         if (format === 'pdf' || format === 'doc' || format === 'odt') {
             // Get the blob from the response
             const blob = await response.blob();
+            const etag = response.headers.get('ETag');
+            if (etag) {
+                lastRenderedDocument = { etag, blob };
+            }
             return {
                 content: blob,
                 type: getContentType(format),
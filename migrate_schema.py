@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Schema Migration Script for Mr. Wlah
+
+Collapses legacy user ID fields onto the canonical, indexed `user_id`:
+
+- users: records that only carry auth0Id (or auth0_id) get user_id. auth0Id
+  is kept (see INDEX_SPECS in db_indexes.py).
+- transformations: userId is folded into user_id and removed.
+
+Then users sharing a user_id (left by the old lookup-then-insert login
+path) are merged into the oldest record, so db_indexes.py, which runs
+next, can build the unique user_id index.
+
+Documents are walked in _id order and rewritten in batches with bulk_write.
+Each update is a pipeline evaluated by the server against the document's
+current state, so concurrent writes from the app are never overwritten.
+Progress is checkpointed in the `migrations` collection after every batch;
+an interrupted run resumes where it stopped.
+
+    python migrate_schema.py                  # run (or resume) the migration
+    python migrate_schema.py --batch-size 200 --pause 0.5
+    python migrate_schema.py --restart        # ignore the checkpoint
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from db_indexes import DEFAULT_MONGODB_URI, connect, existing_index_key
+
+# Load environment variables
+load_dotenv()
+
+MIGRATION_NAME = 'normalize-user-id'
+
+# (collection, filter matching documents still to migrate, update pipeline)
+MIGRATION_STEPS = [
+    (
+        'users',
+        {'user_id': {'$exists': False}},
+        [{'$set': {'user_id': {'$ifNull': ['$auth0Id', {'$ifNull': ['$auth0_id', {'$toString': '$_id'}]}]}}}]
+    ),
+    (
+        'transformations',
+        {'userId': {'$exists': True}},
+        [{'$set': {'user_id': {'$ifNull': ['$user_id', '$userId']}}}, {'$unset': 'userId'}]
+    ),
+]
+
+
+def load_checkpoint(migrations, restart=False):
+    """The migration's checkpoint document, created (or reset) as needed"""
+    now = datetime.datetime.utcnow()
+    if restart:
+        migrations.delete_one({'_id': MIGRATION_NAME})
+    migrations.update_one(
+        {'_id': MIGRATION_NAME},
+        {'$setOnInsert': {'status': 'pending', 'steps': {}, 'createdAt': now}},
+        upsert=True
+    )
+    return migrations.find_one({'_id': MIGRATION_NAME})
+
+
+def migrate_collection(db, migrations, collection_name, pending, pipeline, checkpoint,
+                       batch_size=500, pause=0.0, log=print):
+    """Migrate one collection in _id-ordered batches, saving progress after each batch"""
+    collection = db[collection_name]
+    progress = checkpoint['steps'].get(collection_name, {})
+    if progress.get('done'):
+        log(f"{collection_name}: already migrated ({progress.get('modified', 0)} documents)")
+        return progress
+
+    last_id = progress.get('lastId')
+    processed = progress.get('processed', 0)
+    modified = progress.get('modified', 0)
+
+    remaining_filter = dict(pending, **({'_id': {'$gt': last_id}} if last_id is not None else {}))
+    total = processed + collection.count_documents(remaining_filter)
+    log(f"{collection_name}: {total - processed} documents to migrate" + (f" (resuming after {processed})" if processed else ""))
+
+    started = time.monotonic()
+    while True:
+        batch_filter = dict(pending, **({'_id': {'$gt': last_id}} if last_id is not None else {}))
+        ids = [doc['_id'] for doc in collection.find(batch_filter, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+        if not ids:
+            break
+
+        # The pending filter is repeated so a document fixed meanwhile is left alone
+        requests = [UpdateOne(dict(pending, _id=doc_id), pipeline) for doc_id in ids]
+        try:
+            result = collection.bulk_write(requests, ordered=False)
+            modified += result.modified_count
+        except BulkWriteError as e:
+            # Record what did get through before giving up on this run
+            modified += e.details.get('nModified', 0)
+            migrations.update_one({'_id': MIGRATION_NAME}, {'$set': {
+                f'steps.{collection_name}': {'lastId': last_id, 'processed': processed, 'modified': modified},
+                'status': 'failed',
+                'updatedAt': datetime.datetime.utcnow()
+            }})
+            raise
+
+        last_id = ids[-1]
+        processed += len(ids)
+        migrations.update_one({'_id': MIGRATION_NAME}, {'$set': {
+            f'steps.{collection_name}': {'lastId': last_id, 'processed': processed, 'modified': modified},
+            'status': 'running',
+            'updatedAt': datetime.datetime.utcnow()
+        }})
+
+        elapsed = time.monotonic() - started
+        percent = processed * 100 // total if total else 100
+        log(f"{collection_name}: {processed}/{total} ({percent}%) processed, {modified} modified, {elapsed:.1f}s")
+
+        if pause:
+            # Leave room for live traffic between batches
+            time.sleep(pause)
+
+    progress = {'lastId': last_id, 'processed': processed, 'modified': modified, 'done': True}
+    migrations.update_one({'_id': MIGRATION_NAME}, {'$set': {
+        f'steps.{collection_name}': progress,
+        'updatedAt': datetime.datetime.utcnow()
+    }})
+    return progress
+
+
+def run_migration(db, batch_size=500, pause=0.0, restart=False, log=print):
+    """Run every migration step; returns the final checkpoint document"""
+    migrations = db['migrations']
+    checkpoint = load_checkpoint(migrations, restart=restart)
+    if checkpoint['status'] == 'complete':
+        log(f"Migration '{MIGRATION_NAME}' already complete")
+        return checkpoint
+
+    for collection_name, pending, pipeline in MIGRATION_STEPS:
+        migrate_collection(db, migrations, collection_name, pending, pipeline, checkpoint,
+                           batch_size=batch_size, pause=pause, log=log)
+
+    migrations.update_one({'_id': MIGRATION_NAME}, {'$set': {
+        'status': 'complete',
+        'completedAt': datetime.datetime.utcnow()
+    }})
+    return migrations.find_one({'_id': MIGRATION_NAME})
+
+
+def dedupe_user_ids(db, log=print):
+    """
+    Merge users that share a user_id into the oldest of them, keeping the
+    latest activity times and admin flag; returns the number of records
+    removed. Skipped once user_id is uniquely indexed, since duplicates
+    can't exist then.
+    """
+    users = db['users']
+    for info in users.index_information().values():
+        if existing_index_key(info) == (('user_id', 1),) and info.get('unique'):
+            log("users: user_id is already unique")
+            return 0
+
+    groups = users.aggregate([
+        {'$match': {'user_id': {'$exists': True}}},
+        {'$sort': {'_id': 1}},
+        {'$group': {
+            '_id': '$user_id',
+            'ids': {'$push': '$_id'},
+            'lastLogin': {'$max': '$lastLogin'},
+            'lastActive': {'$max': '$lastActive'},
+            'is_admin': {'$max': '$is_admin'}
+        }},
+        {'$match': {'ids.1': {'$exists': True}}}
+    ], allowDiskUse=True)
+
+    removed = 0
+    for group in groups:
+        keep, duplicates = group['ids'][0], group['ids'][1:]
+        merged = {field: group[field] for field in ('lastLogin', 'lastActive', 'is_admin') if group.get(field) is not None}
+        if merged:
+            users.update_one({'_id': keep}, {'$max': merged})
+        removed += users.delete_many({'_id': {'$in': duplicates}}).deleted_count
+    log(f"users: merged {removed} duplicate records" if removed else "users: no duplicate user_ids")
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Normalize legacy user ID fields onto user_id")
+    parser.add_argument('--uri', default=os.getenv('MONGODB_URI', DEFAULT_MONGODB_URI), help='MongoDB connection URI')
+    parser.add_argument('--database', default=os.getenv('MONGODB_DATABASE', 'benchai'), help='Database name')
+    parser.add_argument('--batch-size', type=int, default=500, help='Documents per bulk_write')
+    parser.add_argument('--pause', type=float, default=0.0, help='Seconds to wait between batches')
+    parser.add_argument('--restart', action='store_true', help='Ignore the saved checkpoint and start over')
+    args = parser.parse_args()
+
+    try:
+        db = connect(args.uri, args.database)
+        checkpoint = run_migration(db, batch_size=args.batch_size, pause=args.pause, restart=args.restart)
+        dedupe_user_ids(db)
+    except Exception as e:
+        print(f"❌ Migration failed (rerun to resume): {str(e)}")
+        return 1
+
+    print(f"✅ Migration '{MIGRATION_NAME}' {checkpoint['status']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
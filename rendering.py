@@ -0,0 +1,559 @@
+"""
+Document Rendering for Mr. Wlah
+
+Builds the downloadable versions of transformed text. Kept out of app.py so
+the renderers can be benchmarked without booting the Flask app, and so they
+can run on a shared process pool instead of the request worker.
+"""
+
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+import docx
+from docx.shared import Pt
+from dotenv import load_dotenv
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+load_dotenv()
+
+# Bump when any renderer's output changes, so cached renders are not reused
+RENDERER_VERSION = 1
+
+# Renders are content-addressed, so the same text must always produce the
+# same bytes: zip entries get a fixed timestamp and PDFs are built invariant
+ZIP_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+
+# Render pool: size, how many renders may be running or waiting per web
+# process before new ones are turned away, and how long a request waits
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', os.cpu_count() or 1))
+RENDER_QUEUE_LIMIT = int(os.getenv('RENDER_QUEUE_LIMIT', 16))
+RENDER_TIMEOUT = int(os.getenv('RENDER_TIMEOUT', 60))
+
+PDF_FONT = "Helvetica"
+PDF_FONT_SIZE = 12
+PDF_LEADING = 15         # Distance between wrapped lines
+PDF_PARAGRAPH_GAP = 20   # Extra space for each blank line
+PDF_MARGIN = 72          # 1 inch margins
+
+
+@lru_cache(maxsize=65536)
+def text_width(text, font=PDF_FONT, size=PDF_FONT_SIZE):
+    """Measured width of a word; the same words recur constantly, so widths are cached"""
+    return stringWidth(text, font, size)
+
+
+def split_long_word(word, max_width):
+    """Break a word wider than the line into pieces that fit"""
+    piece = ''
+    width = 0
+    for char in word:
+        char_width = text_width(char)
+        if piece and width + char_width > max_width:
+            yield piece
+            piece, width = char, char_width
+        else:
+            piece += char
+            width += char_width
+    if piece:
+        yield piece
+
+
+def wrap_line(line, max_width):
+    """Yield the pieces of line that fit within max_width points, breaking between words"""
+    space_width = text_width(' ')
+    words = []
+    width = 0
+
+    for word in line.split():
+        word_width = text_width(word)
+        if word_width > max_width:
+            if words:
+                yield ' '.join(words)
+            *pieces, word = split_long_word(word, max_width)
+            yield from pieces
+            words, width = [word], text_width(word)
+        elif words and width + space_width + word_width > max_width:
+            yield ' '.join(words)
+            words, width = [word], word_width
+        else:
+            width += word_width + (space_width if words else 0)
+            words.append(word)
+
+    if words:
+        yield ' '.join(words)
+
+
+def render_pdf(text, output):
+    """
+    Write text as a letter-size PDF to the file-like output. Lines are
+    wrapped by measured width and each page is drawn as one text object.
+    """
+    pdf = canvas.Canvas(output, pagesize=letter, pageCompression=1, invariant=1)
+    page_width, page_height = letter
+    max_width = page_width - 2 * PDF_MARGIN
+    top = page_height - PDF_MARGIN
+
+    def begin_page():
+        text_object = pdf.beginText(PDF_MARGIN, top)
+        text_object.setFont(PDF_FONT, PDF_FONT_SIZE, PDF_LEADING)
+        return text_object
+
+    text_object = begin_page()
+    y_position = top
+    moved = False  # Blank lines moved the cursor away from the next line's origin
+
+    for line in text.split('\n'):
+        if not line.strip():
+            # Gaps at the top of a page are dropped
+            if y_position < top:
+                y_position -= PDF_PARAGRAPH_GAP
+                moved = True
+            continue
+
+        for wrapped in wrap_line(line, max_width):
+            if y_position < PDF_MARGIN:
+                pdf.drawText(text_object)
+                pdf.showPage()
+                text_object = begin_page()
+                y_position = top
+                moved = False
+            elif moved:
+                text_object.setTextOrigin(PDF_MARGIN, y_position)
+                moved = False
+
+            text_object.textLine(wrapped)
+            y_position -= PDF_LEADING
+
+    pdf.drawText(text_object)
+    pdf.save()
+    return output
+
+
+DOCUMENT_TITLE = 'Mr. Wlah Transformed Text'
+
+
+def zip_entry(name, compress_type=zipfile.ZIP_DEFLATED):
+    """ZipInfo with the fixed timestamp"""
+    entry = zipfile.ZipInfo(name, date_time=ZIP_TIMESTAMP)
+    entry.compress_type = compress_type
+    return entry
+
+
+def render_docx(text, output):
+    """Write text as a DOCX file to the file-like output"""
+    doc = docx.Document()
+
+    # Add title
+    title = doc.add_heading(DOCUMENT_TITLE, 0)
+    title.alignment = 1  # Center alignment
+
+    # Add paragraphs
+    for para in text.split('\n\n'):
+        if para.strip():
+            p = doc.add_paragraph()
+            p.add_run(para).font.size = Pt(12)
+
+    # python-docx stamps every zip entry with the current time; copy the
+    # package into output with fixed timestamps instead
+    package = io.BytesIO()
+    doc.save(package)
+    with zipfile.ZipFile(package) as source, zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for entry in source.infolist():
+            archive.writestr(zip_entry(entry.filename), source.read(entry))
+    return output
+
+
+ODT_MIMETYPE = 'application/vnd.oasis.opendocument.text'
+
+ODT_NAMESPACES = (
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0" '
+    'office:version="1.2"'
+)
+
+ODT_MANIFEST = f'''<?xml version="1.0" encoding="UTF-8"?>
+<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">
+ <manifest:file-entry manifest:full-path="/" manifest:version="1.2" manifest:media-type="{ODT_MIMETYPE}"/>
+ <manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>
+ <manifest:file-entry manifest:full-path="styles.xml" manifest:media-type="text/xml"/>
+</manifest:manifest>
+'''
+
+# Same look as the DOCX export: a centred title over 12pt body paragraphs
+ODT_STYLES = f'''<?xml version="1.0" encoding="UTF-8"?>
+<office:document-styles {ODT_NAMESPACES}>
+ <office:styles>
+  <style:default-style style:family="paragraph">
+   <style:text-properties fo:font-size="12pt"/>
+  </style:default-style>
+  <style:style style:name="Title" style:family="paragraph">
+   <style:paragraph-properties fo:text-align="center" fo:margin-bottom="0.25in"/>
+   <style:text-properties fo:font-size="26pt"/>
+  </style:style>
+  <style:style style:name="Text_20_body" style:display-name="Text body" style:family="paragraph">
+   <style:paragraph-properties fo:margin-bottom="0.1in"/>
+   <style:text-properties fo:font-size="12pt"/>
+  </style:style>
+ </office:styles>
+</office:document-styles>
+'''
+
+# Characters XML 1.0 does not allow, even escaped. Lone surrogates (e.g. from
+# JSON "\ud83d" escapes) are included: they cannot be encoded as UTF-8 at all.
+XML_INVALID_PATTERN = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+ODT_SPACES_PATTERN = re.compile(r' {2,}')
+
+
+def odt_paragraph(text, style='Text_20_body'):
+    """One <text:p>; line breaks, tabs and runs of spaces use their ODF elements"""
+    body = escape(XML_INVALID_PATTERN.sub('', text))
+    body = ODT_SPACES_PATTERN.sub(lambda match: f' <text:s text:c="{len(match.group(0)) - 1}"/>', body)
+    body = body.replace('\t', '<text:tab/>').replace('\n', '<text:line-break/>')
+    return f'<text:p text:style-name="{style}">{body}</text:p>\n'
+
+
+def render_odt(text, output):
+    """
+    Write text as an OpenDocument text file to the file-like output. The
+    zip is written entry by entry and content.xml a paragraph at a time,
+    so output can be an unseekable stream.
+    """
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        # The mimetype entry must come first and be stored uncompressed
+        archive.writestr(zip_entry('mimetype', zipfile.ZIP_STORED), ODT_MIMETYPE)
+        archive.writestr(zip_entry('META-INF/manifest.xml'), ODT_MANIFEST)
+        archive.writestr(zip_entry('styles.xml'), ODT_STYLES)
+
+        with archive.open(zip_entry('content.xml'), 'w') as content:
+            content.write(
+                f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<office:document-content {ODT_NAMESPACES}>\n'
+                f'<office:body><office:text>\n'.encode('utf-8')
+            )
+            content.write(odt_paragraph(DOCUMENT_TITLE, 'Title').encode('utf-8'))
+            for paragraph in text.split('\n\n'):
+                if paragraph.strip():
+                    content.write(odt_paragraph(paragraph).encode('utf-8'))
+            content.write(b'</office:text></office:body>\n</office:document-content>\n')
+
+    return output
+
+
+# fileType values accepted for downloads: (renderer, MIME type, file extension)
+RENDER_FORMATS = {
+    'pdf': (render_pdf, 'application/pdf', 'pdf'),
+    'doc': (render_docx, 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'docx'),
+    'odt': (render_odt, ODT_MIMETYPE, 'odt'),
+}
+
+# File extension back to its fileType
+RENDER_EXTENSIONS = {extension: format_type for format_type, (_, _, extension) in RENDER_FORMATS.items()}
+
+
+def render_key(text, format_type):
+    """
+    Content address of a rendered document, e.g. "<sha256>.pdf". Identical
+    text in the same format always renders to the same bytes.
+    """
+    extension = RENDER_FORMATS[format_type][2]
+    digest = hashlib.sha256(f'{RENDERER_VERSION}\0{format_type}\0'.encode('utf-8'))
+    digest.update(text.encode('utf-8', 'surrogatepass'))
+    return f'{digest.hexdigest()}.{extension}'
+
+
+def render_document(text, format_type):
+    """Render text in one of RENDER_FORMATS and return the file's bytes"""
+    renderer = RENDER_FORMATS[format_type][0]
+    return renderer(text, io.BytesIO()).getvalue()
+
+
+class RenderError(Exception):
+    """A document could not be rendered on the pool"""
+
+
+class RenderQueueFull(RenderError):
+    """Too many renders are already running or waiting"""
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+# Counters behind render_pool_stats(); busySeconds is time workers spent rendering
+_render_stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'busySeconds': 0.0}
+# Renders holding a queue slot, including timed-out ones whose worker is
+# still busy; a slot is only released when its future finishes or is
+# cancelled before a worker picks it up
+_render_in_flight = 0
+_render_abandoned = 0
+_render_pool_started = None
+_render_stats_lock = threading.Lock()
+
+
+def render_to_file(text, format_type, directory=None):
+    """
+    Pool task: render into a new .tmp- file in directory, so large documents
+    are not pickled back to the web process. Returns (path, seconds spent).
+    """
+    start = time.perf_counter()
+    fd, path = tempfile.mkstemp(dir=directory, prefix='.tmp-render-')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            RENDER_FORMATS[format_type][0](text, output)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, time.perf_counter() - start
+
+
+def get_render_pool():
+    """Return the render pool shared by all requests, spawning it on first use"""
+    global _render_pool, _render_pool_started
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _render_pool_started = time.monotonic()
+        return _render_pool
+
+
+def reset_render_pool(pool=None):
+    """
+    Drop the shared pool; the next render starts a fresh one. Given the pool
+    a failed render ran on, nothing happens if it has already been replaced.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None and (pool is None or pool is _render_pool):
+            _render_pool.shutdown(wait=False, cancel_futures=True)
+            _render_pool = None
+
+
+def discard_render_result(future):
+    """Done callback for abandoned renders: delete the file nobody will read"""
+    if not future.cancelled() and future.exception() is None:
+        path, _ = future.result()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def submit_render(text, format_type, directory=None):
+    """
+    Queue a render on the shared pool and return its future. Raises
+    RenderQueueFull when RENDER_QUEUE_LIMIT renders are already pending.
+    """
+    global _render_in_flight
+    with _render_stats_lock:
+        if _render_in_flight >= RENDER_QUEUE_LIMIT:
+            _render_stats['rejected'] += 1
+            raise RenderQueueFull("Too many documents are being rendered, please try again shortly")
+        _render_in_flight += 1
+        _render_stats['submitted'] += 1
+
+    try:
+        pool = get_render_pool()
+        try:
+            future = pool.submit(render_to_file, text, format_type, directory)
+        except BrokenProcessPool:
+            # A worker died while the pool was idle; nobody was waiting to reset it
+            reset_render_pool(pool)
+            pool = get_render_pool()
+            future = pool.submit(render_to_file, text, format_type, directory)
+        future.pool = pool
+    except Exception:
+        with _render_stats_lock:
+            _render_in_flight -= 1
+            _render_stats['failed'] += 1
+        raise
+
+    future.add_done_callback(_count_finished_render)
+    return future
+
+
+def _count_finished_render(future):
+    global _render_in_flight, _render_abandoned
+    with _render_stats_lock:
+        _render_in_flight -= 1
+        if getattr(future, 'abandoned', False):
+            _render_abandoned -= 1
+        if future.cancelled() or future.exception() is not None:
+            _render_stats['failed'] += 1
+        else:
+            _render_stats['completed'] += 1
+            _render_stats['busySeconds'] += future.result()[1]
+
+
+def wait_for_render(future):
+    """Wait for a submitted render and return the path of its .tmp- file; the caller owns it"""
+    try:
+        path, _ = future.result(timeout=RENDER_TIMEOUT)
+    except FuturesTimeoutError:
+        abandon_render(future)
+        raise RenderError("Rendering took too long")
+    except BrokenProcessPool:
+        reset_render_pool(future.pool)
+        raise RenderError("Render worker crashed")
+    return path
+
+
+def abandon_render(future):
+    """
+    Give up on a render: cancel it if no worker has picked it up, otherwise
+    delete its file once done. A running render keeps its queue slot until
+    the worker is free again, so the queue limit still counts it.
+    """
+    global _render_abandoned
+    if future.cancel():
+        return
+    with _render_stats_lock:
+        if not future.done():
+            future.abandoned = True
+            _render_abandoned += 1
+    future.add_done_callback(discard_render_result)
+
+
+def render_in_pool(text, format_type, directory=None):
+    """Render on the shared pool into directory (the system temp dir by default) and return the file's path"""
+    return wait_for_render(submit_render(text, format_type, directory))
+
+
+def render_pool_stats():
+    """Pool counters and utilization for this web process"""
+    with _render_stats_lock:
+        stats = dict(_render_stats)
+        in_flight = _render_in_flight
+        stats['abandoned'] = _render_abandoned
+
+    uptime = time.monotonic() - _render_pool_started if _render_pool_started else 0
+    stats.update({
+        'workers': RENDER_WORKERS,
+        'queueLimit': RENDER_QUEUE_LIMIT,
+        'running': min(in_flight, RENDER_WORKERS),
+        'queued': max(in_flight - RENDER_WORKERS, 0),
+        'busySeconds': round(stats['busySeconds'], 3),
+        # Share of worker time spent rendering since the pool started
+        'utilization': round(stats['busySeconds'] / (uptime * RENDER_WORKERS), 3) if uptime else None
+    })
+    return stats
+
+
+# fileType values for bulk export; plain text needs no rendering
+EXPORT_FORMATS = ('pdf', 'doc', 'odt', 'txt')
+EXPORT_CHUNK_SIZE = 256 * 1024
+
+
+class ZipStreamSink(io.RawIOBase):
+    """
+    Unseekable file for zipfile to write into. drain() hands over whatever
+    has been written since the last call, so a response generator can send
+    the archive as it is built.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def submit_export_render(text, format_type):
+    """submit_render that waits for room in the queue instead of failing"""
+    deadline = time.monotonic() + RENDER_TIMEOUT
+    while True:
+        try:
+            return submit_render(text, format_type)
+        except RenderQueueFull:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.25)
+
+
+def iter_export_zip(items, format_type):
+    """
+    Yield a zip archive of (name, date_time, text) items as one file each,
+    chunk by chunk. Documents are rendered on the render pool, with up to
+    RENDER_WORKERS renders running ahead of the entry being written, so
+    neither the archive nor more than a few documents are ever in memory.
+    An item that fails to render is replaced by a .error.txt entry.
+    """
+    sink = ZipStreamSink()
+    pending = deque()
+    items = iter(items)
+
+    def entry(name, date_time, compress_type):
+        info = zipfile.ZipInfo(name, date_time=date_time)
+        info.compress_type = compress_type
+        return info
+
+    try:
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+            if format_type == 'txt':
+                for name, date_time, text in items:
+                    archive.writestr(entry(f'{name}.txt', date_time, zipfile.ZIP_DEFLATED), text)
+                    yield sink.drain()
+            else:
+                extension = RENDER_FORMATS[format_type][2]
+                exhausted = False
+                while pending or not exhausted:
+                    # Keep the pool busy while the oldest render is written out
+                    while not exhausted and len(pending) < max(RENDER_WORKERS, 1):
+                        item = next(items, None)
+                        if item is None:
+                            exhausted = True
+                        else:
+                            pending.append((item[0], item[1], submit_export_render(item[2], format_type)))
+                    if not pending:
+                        break
+
+                    name, date_time, future = pending.popleft()
+                    try:
+                        path = wait_for_render(future)
+                    except Exception as e:
+                        archive.writestr(entry(f'{name}.error.txt', date_time, zipfile.ZIP_DEFLATED),
+                                         f'Could not render this document: {e}')
+                        yield sink.drain()
+                        continue
+
+                    # PDF, DOCX and ODT are already compressed, so they are stored
+                    try:
+                        with open(path, 'rb') as source, \
+                                archive.open(entry(f'{name}.{extension}', date_time, zipfile.ZIP_STORED), 'w') as target:
+                            for chunk in iter(lambda: source.read(EXPORT_CHUNK_SIZE), b''):
+                                target.write(chunk)
+                                yield sink.drain()
+                    finally:
+                        os.unlink(path)
+
+        # The central directory is written when the archive closes
+        yield sink.drain()
+    finally:
+        # The client may disconnect mid-archive; clean up renders still out
+        for _, _, future in pending:
+            abandon_render(future)
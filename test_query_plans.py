@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Query Plan Test Script for Mr. Wlah
+
+Creates the indexes declared in db_indexes.py in a scratch database on a
+local mongod, runs explain() on every hot query and fails if any of them
+falls back to a collection scan.
+
+    MONGODB_TEST_URI=mongodb://localhost:27017 python test_query_plans.py
+"""
+
+import datetime
+import os
+import sys
+import uuid
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from db_indexes import HOT_QUERIES, HOT_USER_ID, explain_hot_query, plan_stages, reconcile_indexes
+
+# Load environment variables
+load_dotenv()
+
+SAMPLE_USERS = 200
+
+
+def insert_sample_data(db):
+    """Enough documents that the planner has real choices to make"""
+    now = datetime.datetime.utcnow()
+    user_ids = [HOT_USER_ID] + [f'auth0|sample-{i}' for i in range(SAMPLE_USERS)]
+
+    db.users.insert_many([{
+        'user_id': user_id,
+        'auth0Id': user_id,
+        'email': f'{i}@example.com',
+        'name': f'Sample User {i}',
+        'createdAt': now - datetime.timedelta(days=i),
+        'lastLogin': now - datetime.timedelta(hours=i),
+        'lastActive': now - datetime.timedelta(hours=i)
+    } for i, user_id in enumerate(user_ids)])
+
+    db.transformations.insert_many([{
+        'user_id': user_id,
+        'tone': 'Professional',
+        'createdAt': now - datetime.timedelta(minutes=i)
+    } for i, user_id in enumerate(user_ids * 5)])
+
+    db.apiUsage.insert_many([{
+        'user_id': user_id,
+        'date': datetime.datetime(now.year, now.month, now.day) - datetime.timedelta(days=day),
+        'callCount': 1
+    } for user_id in user_ids for day in range(3)])
+
+    db.documents.insert_many([{
+        '_id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'text': 'sample',
+        'expiresAt': now + datetime.timedelta(hours=1)
+    } for user_id in user_ids])
+
+
+def test_query_plans():
+    """Explain every hot query; True if none of them scans a whole collection."""
+    print("Testing hot query plans...")
+
+    mongo_uri = os.getenv('MONGODB_TEST_URI', 'mongodb://localhost:27017')
+    database_name = f'mrwlah_query_plans_{uuid.uuid4().hex[:8]}'
+    client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+
+    try:
+        client.admin.command('ping')
+    except Exception as e:
+        print(f"❌ Could not connect to {mongo_uri}: {str(e)}")
+        return False
+
+    try:
+        db = client[database_name]
+        reconcile_indexes(db, log=lambda message: None)
+        insert_sample_data(db)
+
+        success = True
+        for query in HOT_QUERIES:
+            stages = [stage for stage in plan_stages(explain_hot_query(db, query)) if stage]
+            if 'COLLSCAN' in stages:
+                print(f"❌ {query['name']}: {' <- '.join(stages)}")
+                success = False
+            else:
+                print(f"✅ {query['name']}: {' <- '.join(stages)}")
+        return success
+
+    except Exception as e:
+        print(f"❌ Query plan test failed: {str(e)}")
+        return False
+
+    finally:
+        client.drop_database(database_name)
+        client.close()
+
+
+if __name__ == "__main__":
+    success = test_query_plans()
+    sys.exit(0 if success else 1)
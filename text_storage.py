@@ -0,0 +1,55 @@
+"""
+Text Body Storage for Mr. Wlah
+
+Transformation records embed the original and transformed text. Bodies above
+a size threshold are stored as zlib-compressed BinData so large documents
+don't bloat the working set or run into MongoDB's 16 MB document limit;
+short bodies stay plain strings. A preview is stored next to the body at
+write time, so listings can project it without reading the body at all.
+
+pack_text and unpack_text convert between the two representations; every
+read of a stored body goes through unpack_text.
+"""
+
+import zlib
+
+from bson.binary import Binary, USER_DEFINED_SUBTYPE
+
+# Compressed bodies are tagged with their own BinData subtype
+COMPRESSED_TEXT_SUBTYPE = USER_DEFINED_SUBTYPE
+
+# Bodies shorter than this (in UTF-8 bytes) aren't worth compressing
+DEFAULT_COMPRESS_THRESHOLD = 4096
+
+COMPRESSION_LEVEL = 6
+
+
+def pack_text(text, threshold=DEFAULT_COMPRESS_THRESHOLD):
+    """Storage form of a text body: the string itself, or compressed BinData above threshold"""
+    if text is None:
+        return None
+
+    encoded = text.encode('utf-8')
+    if threshold < 0 or len(encoded) < threshold:
+        return text
+
+    compressed = zlib.compress(encoded, COMPRESSION_LEVEL)
+    if len(compressed) >= len(encoded):
+        return text  # Incompressible; not worth the decode on every read
+    return Binary(compressed, COMPRESSED_TEXT_SUBTYPE)
+
+
+def unpack_text(value):
+    """Text body from its storage form (plain strings pass through)"""
+    if isinstance(value, Binary) and value.subtype == COMPRESSED_TEXT_SUBTYPE:
+        return zlib.decompress(value).decode('utf-8')
+    if isinstance(value, bytes):
+        # BinData with a generic subtype comes back as bytes
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+
+def text_preview(text, max_chars):
+    """(preview, truncated) for a text body, computed once at write time"""
+    text = text or ''
+    return text[:max_chars], len(text) > max_chars
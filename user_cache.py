@@ -0,0 +1,187 @@
+"""
+User Record Cache for Mr. Wlah
+
+A per-worker read-through cache of user documents keyed by user_id, so
+requests from the same user don't reload their record from MongoDB each
+time. Entries expire after a short TTL and the least recently used ones
+are dropped past a size bound.
+
+Writes made through this worker invalidate their entry directly (or replace
+it with the written document). Writes and deletions made by other workers
+or tools are picked up when the entry expires, or right away when the
+optional change-stream listener is enabled (MongoDB has to run as a replica
+set for that).
+
+Callers get deep copies, so changing a returned document (or its nested
+preferences) never changes the cached one.
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo.errors import PyMongoError
+
+# Updates touching only these fields don't invalidate entries; activity
+# timestamps are flushed in the background and may lag by up to the TTL
+VOLATILE_FIELDS = frozenset(('lastActive', 'lastLogin'))
+
+
+class UserCache:
+    """TTL and size bounded read-through cache of user documents"""
+
+    def __init__(self, collection=None, ttl_seconds=30, max_entries=1024, watch_changes=False, on_error=None):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.watch_changes = watch_changes
+        self.on_error = on_error
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # user_id -> (expires_at, document); _id -> user_id for change events
+        self._entries = OrderedDict()
+        self._ids = {}
+        # Bumped by every invalidation, so a load that raced one isn't cached
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._watcher_pid = None
+        self._watching = False
+
+    @property
+    def enabled(self):
+        return self.collection is not None and self.ttl_seconds > 0 and self.max_entries > 0
+
+    def get(self, user_id):
+        """The user's document (a copy), loading it on a miss; None if there is no such user"""
+        if self.collection is None or not user_id:
+            return None
+        if not self.enabled:
+            return self.collection.find_one({'user_id': user_id})
+
+        document, generation = self._lookup(user_id)
+        if document is not None:
+            return document
+
+        document = self.collection.find_one({'user_id': user_id})
+        if document is not None:
+            self._store(user_id, document, generation)
+            return copy.deepcopy(document)
+        return None
+
+    def peek(self, user_id):
+        """The user's cached document (a copy), or None on a miss; never queries MongoDB"""
+        if not self.enabled or not user_id:
+            return None
+        return self._lookup(user_id)[0]
+
+    def put(self, document):
+        """Cache a user document just read or written by this worker (e.g. an upsert's result)"""
+        if not self.enabled or not document or not document.get('user_id'):
+            return
+        with self._lock:
+            generation = self._generation
+        self._store(document['user_id'], document, generation)
+
+    def _lookup(self, user_id):
+        """(copy of the live entry or None, generation to store a load under)"""
+        self._ensure_watching()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return copy.deepcopy(entry[1]), None
+            self.misses += 1
+            return None, self._generation
+
+    def _store(self, user_id, document, generation):
+        document = copy.deepcopy(document)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, document)
+            self._entries.move_to_end(user_id)
+            self._ids[document['_id']] = user_id
+            while len(self._entries) > self.max_entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._ids.pop(evicted['_id'], None)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        """Drop user_id's entry; call after writing to the user's record"""
+        with self._lock:
+            self._generation += 1
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self._ids.pop(entry[1]['_id'], None)
+                self.invalidations += 1
+
+    def invalidate_document(self, document_id):
+        """Drop the entry for a user record by its _id (change events only carry that)"""
+        with self._lock:
+            self._generation += 1
+            user_id = self._ids.pop(document_id, None)
+            if user_id is not None and self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._ids.clear()
+
+    def _ensure_watching(self):
+        """Start the change-stream listener in this process (worker processes fork after import)"""
+        if not self.watch_changes or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, name='user-cache-watch', daemon=True).start()
+
+    def _watch(self):
+        """Invalidate entries as other workers write to users; falls back to the TTL on failure"""
+        try:
+            pipeline = [{'$project': {'documentKey': 1, 'operationType': 1, 'updateDescription': 1}}]
+            with self.collection.watch(pipeline) as stream:
+                self._watching = True
+                for change in stream:
+                    if change['operationType'] in ('invalidate', 'drop', 'rename', 'dropDatabase'):
+                        self.clear()
+                    elif 'documentKey' in change and not self._is_volatile_update(change):
+                        self.invalidate_document(change['documentKey']['_id'])
+        except PyMongoError as e:
+            # Typically a standalone server, which has no change streams
+            self.clear()
+            if self.on_error:
+                self.on_error(e)
+        finally:
+            self._watching = False
+
+    @staticmethod
+    def _is_volatile_update(change):
+        description = change.get('updateDescription')
+        if change['operationType'] != 'update' or not description:
+            return False
+        return not description.get('removedFields') and set(description.get('updatedFields', {})) <= VOLATILE_FIELDS
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self._lock:
+            size = len(self._entries)
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'size': size,
+            'maxEntries': self.max_entries,
+            'ttlSeconds': self.ttl_seconds,
+            'watchingChanges': self._watching
+        }